@@ -4,8 +4,6 @@ import sys
 import threading
 import time
 import webbrowser
-import tkinter as tk
-from tkinter import messagebox
 import requests
 from flask import Flask, request, send_file, jsonify, render_template_string, render_template
 from flask_cors import CORS
@@ -14,9 +12,35 @@ import uuid
 import logging
 from datetime import datetime
 import json
+import io
+import hashlib
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # Add your existing filter functions here
-from oldfilms_filters import get_decade_filter_config, build_filter_command, process_video_with_ffmpeg
+from oldfilms_filters import (
+    get_decade_filter_config, build_filter_command, process_video_with_ffmpeg, get_encoder_settings,
+    get_encode_profile, normalize_options, plan_streams, engine_effects,
+    estimate_cost, preset_registry, terminate_encodes, probe_head, FilterOptionError
+)
+from jobs import JobManager, JOB_DONE
+from result_cache import ResultCache, hash_file
+from previews import PreviewRenderer, PreviewError
+from chunked_uploads import ChunkedUploadStore, UploadError
+from batch import BatchRunner
+from janitor import DiskJanitor, sharded_path
+from metrics import JobMetrics
+from metadata import MetadataIndex, summarize
+from profiling import profile_chain
+from server import SERVER_AVAILABLE, DRAIN_TIMEOUT, make_server
+
+# The desktop launcher needs tkinter; the headless server (server.py) does not
+try:
+    import tkinter as tk
+    from tkinter import messagebox
+except ImportError:
+    tk = messagebox = None
 
 app = Flask(__name__, template_folder='templates', static_folder='static')  # 添加模板和静态文件配置
 CORS(app)
@@ -24,14 +48,191 @@ CORS(app)
 # Disable Flask logging for cleaner output
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
 
-UPLOAD_FOLDER = 'uploads'
-PROCESSED_FOLDER = 'processed'
+# Data folders live next to the app (or under OLDFILMS_DATA_DIR), whatever
+# directory the server is started from
+DATA_DIR = os.path.abspath(os.environ.get('OLDFILMS_DATA_DIR') or os.path.dirname(os.path.abspath(__file__)))
+UPLOAD_FOLDER = os.path.join(DATA_DIR, 'uploads')
+PROCESSED_FOLDER = os.path.join(DATA_DIR, 'processed')
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'webm', 'mkv'}
 
+# Containers ffmpeg can always demux from a pipe; MP4/MOV only when the
+# moov atom comes before the media data
+STREAMABLE_EXTENSIONS = {'webm', 'mkv'}
+STREAM_HEAD_BYTES = 64 * 1024
+STREAM_CHUNK_BYTES = 256 * 1024
+# Chunks buffered between the upload and ffmpeg's stdin
+STREAM_QUEUE_CHUNKS = 16
+
+# Upper bound on simultaneous ffmpeg encodes; extra uploads wait in the queue
+MAX_CONCURRENT_JOBS = int(os.environ.get('OLDFILMS_MAX_JOBS', '0')) or None
+
+# Estimated seconds of queued work per encode slot beyond which new uploads
+# get 429 with Retry-After (see JobManager.retry_after); 0 admits everything
+MAX_BACKLOG_SECONDS = int(os.environ.get('OLDFILMS_MAX_BACKLOG_SECONDS', '1800')) or None
+
+# Split long inputs into segments encoded side by side (see process_video_parallel)
+PARALLEL_ENCODING = os.environ.get('OLDFILMS_PARALLEL', '0') == '1'
+
+# Finished outputs are kept here and reused for identical resubmissions
+CACHE_FOLDER = os.path.join(PROCESSED_FOLDER, 'cache')
+CACHE_MAX_BYTES = int(os.environ.get('OLDFILMS_CACHE_MAX_MB', '2048')) * 1024 * 1024
+
+# Preview sources are kept by content hash so repeated previews skip the upload
+PREVIEW_SOURCE_FOLDER = os.path.join(UPLOAD_FOLDER, 'previews')
+
+# Resumable chunked uploads (see chunked_uploads.py): sessions in progress,
+# and finished uploads kept by content hash so repeats are not sent again
+PARTIAL_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'partial')
+STORED_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'store')
+PREVIEW_PROXY_FOLDER = os.path.join(PROCESSED_FOLDER, 'previews')
+
+# Batches read and write files on the server's own disk, so /api/batch is
+# off unless this names the directory every batch path must lie inside
+BATCH_FOLDER = os.path.join(PROCESSED_FOLDER, 'batch')
+BATCH_ROOT = os.environ.get('OLDFILMS_BATCH_ROOT')
+
+# ffprobe results of every input, keyed by content hash (see metadata.py)
+METADATA_FOLDER = os.path.join(PROCESSED_FOLDER, 'metadata')
+METADATA_INDEX_PATH = os.path.join(METADATA_FOLDER, 'probes.sqlite')
+
+# Disk lifecycle (see janitor.py): per-area TTLs and one quota over all of
+# them. Inputs are deleted once their encode succeeds unless kept explicitly
+HOUR = 3600
+UPLOAD_TTL = float(os.environ.get('OLDFILMS_UPLOAD_TTL_HOURS', '24')) * HOUR
+OUTPUT_TTL = float(os.environ.get('OLDFILMS_OUTPUT_TTL_HOURS', '24')) * HOUR
+CACHE_TTL = float(os.environ.get('OLDFILMS_CACHE_TTL_HOURS', '168')) * HOUR
+PREVIEW_TTL = float(os.environ.get('OLDFILMS_PREVIEW_TTL_HOURS', '6')) * HOUR
+DISK_QUOTA_BYTES = int(os.environ.get('OLDFILMS_DISK_QUOTA_MB', '10240')) * 1024 * 1024
+JANITOR_INTERVAL = int(os.environ.get('OLDFILMS_JANITOR_INTERVAL', '600'))
+KEEP_INPUTS = os.environ.get('OLDFILMS_KEEP_INPUTS', '0') == '1'
+
+# Opt-in profiling: ffmpeg -benchmark on every job plus stage and per-filter
+# timing passes (see profiling.py) after it succeeds. The passes run one at a
+# time once the job has given back its encode slot, so they do not count
+# towards its run time or the scheduler's learned rate
+PROFILING = os.environ.get('OLDFILMS_PROFILING', '0') == '1'
+
+# Decade presets (see presets.py) are checked for edits this often; 0 only
+# loads them at startup
+PRESET_RELOAD_INTERVAL = float(os.environ.get('OLDFILMS_PRESET_RELOAD_SECONDS', '5'))
+
+# A finished output never changes under its URL, so browsers may reuse it
+OUTPUT_MAX_AGE = 3600
+
+# Largest request body accepted; bigger uploads get 413 before any is stored
+MAX_UPLOAD_BYTES = int(os.environ.get('OLDFILMS_MAX_UPLOAD_MB', '2048')) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+# Set once shutdown begins: new work is refused while running jobs finish
+draining = threading.Event()
+DRAIN_RETRY_AFTER = 60
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
+job_metrics = JobMetrics()
+profiling_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='oldfilms-profile')
+# Job id -> (custom_options, probe) of succeeded jobs waiting to be profiled
+pending_profiles = {}
+
+def on_job_finish(job):
+    """Record a finished job's metrics and queue its profiling passes, if any"""
+    job_metrics.observe_job(job)
+    profile_args = pending_profiles.pop(job['id'], None)
+    if profile_args and job['status'] == JOB_DONE and not draining.is_set():
+        profiling_executor.submit(profile_job, job, *profile_args)
+    elif profile_args:
+        remove_input(job)
+
+job_manager = JobManager(
+    max_workers=MAX_CONCURRENT_JOBS, on_finish=on_job_finish, max_backlog=MAX_BACKLOG_SECONDS
+)
+# A segment-parallel job starts several ffmpeg processes, so it keeps to its
+# share of the cores when every encode slot is busy
+PARALLEL_JOB_THREADS = max(1, (os.cpu_count() or 1) // job_manager.max_workers)
+job_metrics.add_gauge('oldfilms_jobs_queued', 'Jobs waiting for an encode slot', job_manager.queue_depth)
+job_metrics.add_gauge('oldfilms_jobs_running', 'Jobs currently encoding', job_manager.running_count)
+job_metrics.add_gauge('oldfilms_backlog_seconds', 'Estimated seconds of work queued per encode slot',
+                      lambda: round(job_manager.backlog_seconds(), 1))
+job_metrics.add_gauge('oldfilms_encode_slots', 'Maximum concurrent encodes', lambda: job_manager.max_workers)
+result_cache = ResultCache(CACHE_FOLDER, CACHE_MAX_BYTES)
+preview_renderer = PreviewRenderer(PREVIEW_SOURCE_FOLDER, PREVIEW_PROXY_FOLDER)
+chunked_uploads = ChunkedUploadStore(PARTIAL_UPLOAD_FOLDER, STORED_UPLOAD_FOLDER, max_bytes=MAX_UPLOAD_BYTES)
+metadata_index = MetadataIndex(METADATA_INDEX_PATH)
+batch_runners = {}
+
+def expire_records():
+    """Drop job and batch records whose outputs have had their TTL"""
+    expired = job_manager.expire(OUTPUT_TTL)
+    cutoff = time.time() - OUTPUT_TTL
+    for batch_id, runner in list(batch_runners.items()):
+        finished_at = runner.manifest['finished_at']
+        if finished_at and finished_at < cutoff:
+            # The manifest on disk still records the batch
+            del batch_runners[batch_id]
+            expired += 1
+    if expired:
+        logger.info(f"Expired {expired} finished job and batch records")
+
+disk_janitor = DiskJanitor(
+    {
+        UPLOAD_FOLDER: UPLOAD_TTL,
+        PROCESSED_FOLDER: OUTPUT_TTL,
+        CACHE_FOLDER: CACHE_TTL,
+        PREVIEW_SOURCE_FOLDER: PREVIEW_TTL,
+        PREVIEW_PROXY_FOLDER: PREVIEW_TTL,
+    },
+    max_bytes=DISK_QUOTA_BYTES,
+    interval=JANITOR_INTERVAL,
+    # Open upload sessions are kept whole; idle ones expire with the uploads TTL
+    in_use=lambda: job_manager.active_paths() | chunked_uploads.active_paths(UPLOAD_TTL),
+    # Batch outputs are the user's own results, and the index is not scratch
+    exclude=[BATCH_FOLDER, METADATA_FOLDER],
+    on_sweep=expire_records
+)
+disk_janitor.start()
+# Load the presets now so a broken preset folder fails at startup, not on a request
+preset_registry.current()
+if PRESET_RELOAD_INTERVAL > 0:
+    preset_registry.start(PRESET_RELOAD_INTERVAL)
+
+def begin_drain():
+    """Stop accepting new work; queued and running jobs still complete"""
+    if not draining.is_set():
+        draining.set()
+        for runner in list(batch_runners.values()):
+            runner.stop()
+        # Profiling passes that have not started yet are skipped
+        profiling_executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(
+            f"Draining: {job_manager.running_count()} running, {job_manager.queue_depth()} queued jobs left"
+        )
+
+@app.before_request
+def refuse_while_draining():
+    if draining.is_set() and request.method == 'POST':
+        response = jsonify({'error': 'Server is shutting down, try again shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(DRAIN_RETRY_AFTER)
+        return response
+
+def refuse_if_busy():
+    """429 with Retry-After while the backlog is over its limit, else None"""
+    retry_after = job_manager.retry_after()
+    if retry_after is None:
+        return None
+    job_metrics.record_rejection()
+    response = jsonify({'error': 'Server is busy, try again later', 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f'Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'}), 413
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -48,6 +249,15 @@ def get_local_ip():
     except:
         return "Unable to determine IP"
 
+def parse_custom_options(form):
+    custom_options_json = form.get('custom_options')
+    if custom_options_json:
+        try:
+            return json.loads(custom_options_json)
+        except:
+            pass
+    return None
+
 # Your existing Flask routes
 @app.route('/')
 def index():
@@ -55,57 +265,575 @@ def index():
 
 @app.route('/api/process-video', methods=['POST'])
 def process_video():
-    if 'video' not in request.files:
+    # Checked before request.files, which would read the whole upload
+    busy = refuse_if_busy()
+    if busy:
+        return busy
+    
+    # A finished chunked upload is referred to by its upload id instead
+    upload_id = request.form.get('upload_id')
+    stored_path = None
+    if upload_id:
+        stored_path = chunked_uploads.path(upload_id)
+        if not stored_path:
+            return jsonify({'error': 'Unknown upload, send the video again'}), 404
+        filename = os.path.basename(stored_path)
+    elif 'video' in request.files:
+        file = request.files['video']
+        filename = file.filename
+    else:
         return jsonify({'error': 'No video file provided'}), 400
     
-    file = request.files['video']
     decade = request.form.get('decade', '1980s')
-    custom_options_json = request.form.get('custom_options')
     
-    custom_options = None
-    if custom_options_json:
-        try:
-            custom_options = json.loads(custom_options_json)
-        except:
-            pass
-    
-    if not allowed_file(file.filename):
+    if not allowed_file(filename):
         return jsonify({'error': 'Invalid file type'}), 400
     
+    if decade not in get_decade_filter_config():
+        return jsonify({'error': f'Unknown decade: {decade}'}), 400
+    
+    try:
+        custom_options = normalize_options(decade, parse_custom_options(request.form))
+        encode_profile = get_encode_profile(decade, request.form.get('encode_profile'))
+    except FilterOptionError as e:
+        return jsonify({'error': str(e)}), 400
+    
     file_id = str(uuid.uuid4())
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
-    input_filename = f"{timestamp}_{file_id}_input.mp4"
     output_filename = f"{timestamp}_{file_id}_{decade}_output.mp4"
+    output_path = sharded_path(PROCESSED_FOLDER, output_filename, file_id)
     
-    input_path = os.path.join(UPLOAD_FOLDER, input_filename)
-    output_path = os.path.join(PROCESSED_FOLDER, output_filename)
+    if stored_path:
+        # The stored upload stays for later repeats; the janitor expires it
+        return queue_processing(
+            stored_path, output_path, decade, custom_options, encode_profile, timestamp,
+            input_hash=upload_id, shared_input=True
+        )
+    
+    # Keep the real extension so ffmpeg and the stream plan see the source format
+    extension = filename.rsplit('.', 1)[1].lower()
+    input_filename = f"{timestamp}_{file_id}_input.{extension}"
+    input_path = sharded_path(UPLOAD_FOLDER, input_filename, file_id)
     
     file.save(input_path)
     
-    success, message = process_video_with_ffmpeg(input_path, output_path, decade, custom_options)
+    return queue_processing(input_path, output_path, decade, custom_options, encode_profile, timestamp)
+
+def finish_job(job, cache_key, decade, custom_options, encode_profile, probe=None):
+    """Cache a successful job's output, then drop its input or keep it for profiling"""
+    output_path = result_cache.put(cache_key, job['output_path'])
+    job_manager.update(job['id'], output_path=output_path, output_bytes=os.path.getsize(output_path))
+    
+    if PROFILING:
+        # Profiled after the job releases its slot (see on_job_finish)
+        pending_profiles[job['id']] = (custom_options, probe)
+    else:
+        remove_input(job)
+
+def profile_job(job, custom_options, probe):
+    """Run the profiling passes of a finished job, then drop its input"""
+    try:
+        profiling = profile_chain(job['input_path'], job['decade'], custom_options, probe, job['encode_profile'])
+        job_manager.update(job['id'], profiling=profiling)
+        job_metrics.observe_profiling(job['decade'], profiling)
+    except (RuntimeError, OSError) as e:
+        logger.warning(f"Profiling job {job['id']} failed: {e}")
+    finally:
+        remove_input(job)
+
+def remove_input(job):
+    """Delete a job's uploaded input once its output is safely cached"""
+    if KEEP_INPUTS or job.get('shared_input'):
+        return
+    try:
+        os.remove(job['input_path'])
+    except OSError as e:
+        logger.warning(f"Could not remove input {job['input_path']}: {e}")
+
+def make_cache_key(input_hash, decade, custom_options, encode_profile):
+    # Whether the frame engine ran changes the output, so it is part of the key
+    filter_string = build_filter_command(decade, custom_options)
+    effects = engine_effects(decade, custom_options)
+    if effects:
+        filter_string += '|engine:' + ','.join(effects)
+    return ResultCache.make_key(
+        input_hash, decade, custom_options, get_encoder_settings(decade, encode_profile), filter_string
+    )
+
+def queue_processing(input_path, output_path, decade, custom_options, encode_profile, timestamp,
+                     input_hash=None, shared_input=False):
+    """Answer from the result cache, or queue an encode of a saved upload
+
+    A shared input (a stored chunked upload) is never deleted here.
+    """
+    input_hash = input_hash or hash_file(input_path)
+    cache_key = make_cache_key(input_hash, decade, custom_options, encode_profile)
+    download_name = f'{decade}-vintage-{timestamp}.mp4'
+    
+    cached_path = result_cache.get(cache_key)
+    if cached_path:
+        if not shared_input:
+            os.remove(input_path)
+        job_metrics.record_cache_hit()
+        job_id = job_manager.add_done(
+            decade=decade,
+            encode_profile=encode_profile,
+            output_path=cached_path,
+            download_name=download_name,
+            cached=True,
+            media=summarize(metadata_index.get(input_hash))
+        )
+        return job_response(job_id, 200)
+    
+    # The same clip is already being encoded, so wait on that job instead
+    running_job = job_manager.find_active(cache_key=cache_key)
+    if running_job:
+        if not shared_input:
+            os.remove(input_path)
+        return job_response(running_job['id'])
     
-    if not success:
-        return jsonify({'error': message}), 500
+    # The estimate decides where the job runs in the queue (see JobManager)
+    probe = metadata_index.probe(input_path, input_hash)
+    cost = estimate_cost(probe, decade, custom_options, encode_profile) if probe else None
+    
+    def run_job(job):
+        def report_progress(progress):
+            job_manager.update(job['id'], progress=progress)
+        
+        # Probe once here so the stream plan is visible on the job record
+        probe = metadata_index.probe(job['input_path'], job['input_hash'])
+        plan = plan_streams(probe)
+        job_manager.update(
+            job['id'], plan=plan, media=summarize(probe), input_bytes=os.path.getsize(job['input_path'])
+        )
+        
+        success, message = process_video_with_ffmpeg(
+            job['input_path'], job['output_path'], decade, custom_options,
+            progress_callback=report_progress,
+            parallel=PARALLEL_ENCODING,
+            threads=PARALLEL_JOB_THREADS if PARALLEL_ENCODING else None,
+            encode_profile=encode_profile,
+            probe=probe,
+            plan=plan,
+            benchmark=PROFILING
+        )
+        if success:
+            finish_job(job, cache_key, decade, custom_options, encode_profile, probe)
+        return success, message
+    
+    job_id = job_manager.submit(
+        run_job,
+        decade=decade,
+        encode_profile=encode_profile,
+        input_path=input_path,
+        output_path=output_path,
+        download_name=download_name,
+        cache_key=cache_key,
+        input_hash=input_hash,
+        shared_input=shared_input,
+        client=request.remote_addr,
+        cost=cost,
+        cached=False,
+        plan=None,
+        media=None,
+        progress=None
+    )
+    
+    return job_response(job_id)
+
+def mp4_moov_first(head):
+    """Whether an MP4/MOV header puts its moov atom before the media data"""
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        box_type = head[offset + 4:offset + 8]
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1 and offset + 16 <= len(head):
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+def can_stream_upload(extension, head):
+    if extension in STREAMABLE_EXTENSIONS:
+        return True
+    if extension in ('mp4', 'mov'):
+        return mp4_moov_first(head)
+    return False
+
+def feed_chunk(chunks, chunk, job_id):
+    """Hand a chunk to a streaming job; False once the job stopped reading"""
+    while not job_manager.is_finished(job_id):
+        try:
+            chunks.put(chunk, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+@app.route('/api/process-stream', methods=['POST'])
+def process_stream():
+    """Encode a raw video request body while it is still being uploaded"""
+    filename = request.args.get('filename', '')
+    decade = request.args.get('decade', '1980s')
+    
+    if not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    if decade not in get_decade_filter_config():
+        return jsonify({'error': f'Unknown decade: {decade}'}), 400
+    
+    try:
+        custom_options = normalize_options(decade, parse_custom_options(request.args))
+        encode_profile = get_encode_profile(decade, request.args.get('encode_profile'))
+    except FilterOptionError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    busy = refuse_if_busy()
+    if busy:
+        return busy
+    
+    file_id = str(uuid.uuid4())
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = filename.rsplit('.', 1)[1].lower()
+    input_path = sharded_path(UPLOAD_FOLDER, f"{timestamp}_{file_id}_input.{extension}", file_id)
+    output_path = sharded_path(PROCESSED_FOLDER, f"{timestamp}_{file_id}_{decade}_output.mp4", file_id)
+    
+    head = request.stream.read(STREAM_HEAD_BYTES)
+    chunks = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    
+    def run_stream_job(job):
+        def report_progress(progress):
+            job_manager.update(job['id'], progress=progress)
+        
+        success, message = process_video_with_ffmpeg(
+            'pipe:0', job['output_path'], decade, custom_options,
+            progress_callback=report_progress,
+            input_stream=iter(chunks.get, None),
+            probe=head_probe,
+            encode_profile=encode_profile,
+            benchmark=PROFILING
+        )
+        # ffmpeg only finishes after the last chunk, so the upload's outcome is known
+        upload_error = job_manager.get(job['id']).get('upload_error')
+        if upload_error:
+            # A truncated input encodes "successfully" into a truncated output
+            try:
+                os.remove(job['output_path'])
+            except OSError:
+                pass
+            return False, upload_error
+        if success:
+            input_hash = job_manager.get(job['id'])['input_hash']
+            cache_key = make_cache_key(input_hash, decade, custom_options, encode_profile)
+            probe = metadata_index.probe(job['input_path'], input_hash)
+            job_manager.update(job['id'], media=summarize(probe))
+            finish_job(job, cache_key, decade, custom_options, encode_profile, probe)
+        return success, message
+    
+    job_id = None
+    # Frame engine effects need the whole file, so those uploads are spooled first
+    if can_stream_upload(extension, head) and not engine_effects(decade, custom_options):
+        # The header gives the video size and frame rate, which decide where
+        # the chain scales and whether decoding can skip frames
+        head_probe = probe_head(head)
+        job_id = job_manager.try_start(
+            run_stream_job,
+            decade=decade,
+            encode_profile=encode_profile,
+            input_path=input_path,
+            output_path=output_path,
+            download_name=f'{decade}-vintage-{timestamp}.mp4',
+            client=request.remote_addr,
+            cached=False,
+            streaming=True,
+            plan=plan_streams(None),
+            media=None,
+            received_bytes=0,
+            total_bytes=request.content_length,
+            progress=None
+        )
+    
+    if job_id is None:
+        # Not streamable, or every encode slot is busy: spool and queue as usual
+        with open(input_path, 'wb') as f:
+            f.write(head)
+            shutil.copyfileobj(request.stream, f, STREAM_CHUNK_BYTES)
+        return queue_processing(input_path, output_path, decade, custom_options, encode_profile, timestamp)
+    
+    # Keep a copy of the input on disk (and hash it) while ffmpeg reads it
+    hasher = hashlib.sha256()
+    received = 0
+    try:
+        with open(input_path, 'wb') as f:
+            chunk = head
+            while chunk:
+                f.write(chunk)
+                hasher.update(chunk)
+                received += len(chunk)
+                job_manager.update(job_id, received_bytes=received)
+                if not feed_chunk(chunks, chunk, job_id):
+                    break
+                chunk = request.stream.read(STREAM_CHUNK_BYTES)
+    finally:
+        # Runs on a client disconnect too: without the end marker ffmpeg would
+        # wait for more input forever and keep its encode slot
+        expected = request.content_length
+        if expected is not None and received != expected:
+            job_manager.update(job_id, upload_error=f'Upload ended after {received} of {expected} bytes')
+        job_manager.update(job_id, input_hash=hasher.hexdigest(), input_bytes=received)
+        feed_chunk(chunks, None, job_id)
+    return job_response(job_id)
+
+def job_response(job_id, status_code=202):
+    return jsonify({
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}',
+        'download_url': f'/api/jobs/{job_id}/download',
+        'stream_url': f'/api/jobs/{job_id}/stream'
+    }), status_code
+
+@app.route('/api/uploads', methods=['POST'])
+def start_upload():
+    """Open a chunked upload (JSON: filename, size, optional sha256 of the file)"""
+    busy = refuse_if_busy()
+    if busy:
+        return busy
+    
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    if not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    try:
+        session = chunked_uploads.start(filename, data.get('size'), data.get('sha256'))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(session), 200 if session['complete'] else 201
+
+@app.route('/api/uploads/<session_id>', methods=['GET'])
+def get_upload(session_id):
+    """Which chunks of an upload have arrived, for resuming it"""
+    session = chunked_uploads.status(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired upload, start the upload again'}), 404
+    return jsonify(session)
+
+@app.route('/api/uploads/<session_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(session_id, index):
+    """Store one chunk; X-Chunk-CRC32 carries its CRC-32 in hex"""
+    try:
+        session = chunked_uploads.put_chunk(
+            session_id, index, request.get_data(cache=False), request.headers.get('X-Chunk-CRC32')
+        )
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    if session is None:
+        return jsonify({'error': 'Unknown or expired upload, start the upload again'}), 404
+    return jsonify({'received': len(session['received']), 'chunks': session['chunks']})
+
+@app.route('/api/uploads/<session_id>/finalize', methods=['POST'])
+def finalize_upload(session_id):
+    """Check the whole file and store it; the answer's upload_id is passed to /api/process-video"""
+    try:
+        session = chunked_uploads.finalize(session_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 409
+    if session is None:
+        return jsonify({'error': 'Unknown or expired upload, start the upload again'}), 404
+    return jsonify(session)
+
+@app.route('/api/preview', methods=['POST'])
+def preview():
+    """Render a quick low-resolution still or short clip of the chosen look"""
+    decade = request.form.get('decade', '1980s')
+    if decade not in get_decade_filter_config():
+        return jsonify({'error': f'Unknown decade: {decade}'}), 400
+    
+    try:
+        custom_options = normalize_options(decade, parse_custom_options(request.form))
+    except FilterOptionError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    upload_id = request.form.get('upload_id')
+    if 'video' in request.files:
+        file = request.files['video']
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'Invalid file type'}), 400
+        extension = file.filename.rsplit('.', 1)[1].lower()
+        temp_path = os.path.join(PREVIEW_SOURCE_FOLDER, f"{uuid.uuid4()}.upload")
+        file.save(temp_path)
+        upload_id = preview_renderer.add_source(temp_path, extension)
+    elif not preview_renderer.source_path(upload_id):
+        return jsonify({'error': 'Unknown upload, send the video again'}), 404
+    
+    try:
+        data, mimetype = preview_renderer.render(
+            upload_id, decade, custom_options,
+            start=request.form.get('start', 0),
+            mode=request.form.get('mode', 'frame'),
+            duration=request.form.get('duration', 3)
+        )
+    except PreviewError as e:
+        return jsonify({'error': str(e)}), 400
+    except (ValueError, RuntimeError) as e:
+        return jsonify({'error': str(e)}), 500
+    
+    response = send_file(io.BytesIO(data), mimetype=mimetype)
+    response.headers['X-Upload-Id'] = upload_id
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job_manager.to_public(job))
+
+def output_etag(path, stat):
+    """Stable validator for an output file
+
+    Outputs are named after their cache key. The inode and size tell a
+    re-encode apart, while the mtime is left out because downloads bump it
+    for the janitor.
+    """
+    key = os.path.splitext(os.path.basename(path))[0][:32]
+    return f"{key}-{stat.st_ino:x}-{stat.st_size:x}"
+
+def send_output(job_id, as_attachment):
+    """Serve a finished output with Range, ETag and conditional request support"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] != JOB_DONE:
+        return jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409
+    
+    # send_file resolves relative paths against the app folder, not the cwd
+    path = os.path.abspath(job['output_path'])
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return jsonify({'error': 'Output expired, process the video again'}), 410
+    
+    # Only a full download counts as use for the janitor, not every seek
+    if not request.range:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
     
     return send_file(
-        output_path, 
-        as_attachment=True, 
-        download_name=f'{decade}-vintage-{timestamp}.mp4'
+        path,
+        mimetype='video/mp4',
+        as_attachment=as_attachment,
+        download_name=job['download_name'],
+        conditional=True,
+        etag=output_etag(path, stat),
+        last_modified=job['finished_at'],
+        max_age=OUTPUT_MAX_AGE
     )
 
+@app.route('/api/jobs/<job_id>/download', methods=['GET'])
+def download_job(job_id):
+    return send_output(job_id, as_attachment=True)
+
+@app.route('/api/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    """Inline playback of an output; the video element seeks with Range requests"""
+    return send_output(job_id, as_attachment=False)
+
+def batch_path_allowed(path):
+    if not BATCH_ROOT:
+        return False
+    root = os.path.realpath(BATCH_ROOT)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+@app.route('/api/batch', methods=['POST'])
+def start_batch():
+    """Run server-side files or directories through one or more decades"""
+    if not BATCH_ROOT:
+        return jsonify({'error': 'Batches are disabled, set OLDFILMS_BATCH_ROOT to enable them'}), 403
+    busy = refuse_if_busy()
+    if busy:
+        return busy
+    
+    data = request.get_json(silent=True) or {}
+    inputs = data.get('inputs') or []
+    decades = data.get('decades') or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if isinstance(decades, str):
+        decades = [decades]
+    if not inputs or not all(isinstance(path, str) for path in inputs):
+        return jsonify({'error': 'inputs must be a list of paths'}), 400
+    
+    batch_id = str(uuid.uuid4())
+    # Passing the output_dir of an interrupted batch resumes it
+    output_dir = data.get('output_dir') or os.path.join(BATCH_FOLDER, batch_id)
+    # The default output dir is the server's own; a given one must be in the root
+    checked = inputs + ([output_dir] if data.get('output_dir') else [])
+    if not all(batch_path_allowed(path) for path in checked):
+        return jsonify({'error': 'Batch paths must be inside OLDFILMS_BATCH_ROOT'}), 403
+    
+    try:
+        runner = BatchRunner(
+            inputs, decades, output_dir,
+            custom_options=data.get('custom_options'),
+            encode_profile=data.get('encode_profile'),
+            cpu_budget=int(data.get('cpu_budget') or 0) or None,
+            resume=data.get('resume', True) is not False,
+            metadata_index=metadata_index,
+            # Encodes wait for the same slots as web jobs
+            job_manager=job_manager
+        )
+    except (FilterOptionError, ValueError, TypeError, FileNotFoundError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    batch_runners[batch_id] = runner
+    threading.Thread(target=runner.run, daemon=True).start()
+    return jsonify({
+        'batch_id': batch_id,
+        'status_url': f'/api/batch/{batch_id}',
+        'manifest_path': runner.manifest_path
+    }), 202
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    runner = batch_runners.get(batch_id)
+    if runner is None:
+        return jsonify({'error': 'Unknown batch'}), 404
+    return jsonify(runner.status())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Job aggregates in the Prometheus text format"""
+    return app.response_class(job_metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/decades', methods=['GET'])
 def get_decades():
-    return jsonify(get_decade_filter_config())
+    """The presets in use, serialized once per reload and revalidated by ETag"""
+    snapshot = preset_registry.current()
+    response = app.response_class(snapshot.json, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    # Always revalidate, so an edited preset shows up on the next page load
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
-@app.route('/shutdown', methods=['POST'])
-def shutdown():
-    """Shutdown endpoint for clean app exit"""
-    func = request.environ.get('werkzeug.server.shutdown')
-    if func is None:
-        raise RuntimeError('Not running with the Werkzeug Server')
-    func()
-    return 'Server shutting down...'
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness and readiness for load balancers; 503 once draining"""
+    status = {
+        'status': 'draining' if draining.is_set() else 'ok',
+        'running': job_manager.running_count(),
+        'queued': job_manager.queue_depth(),
+        'backlog_seconds': round(job_manager.backlog_seconds(), 1),
+        'encode_slots': job_manager.max_workers,
+    }
+    return jsonify(status), 503 if draining.is_set() else 200
 
 class RetroVideoApp:
     def __init__(self):
@@ -273,7 +1001,10 @@ class RetroVideoApp:
         """Start Flask server in background thread"""
         try:
             # Allow connections from any device on the network
-            app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+            if SERVER_AVAILABLE:
+                make_server(app, '0.0.0.0', 5000, max_body_bytes=MAX_UPLOAD_BYTES).start()
+            else:
+                app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
         except:
             pass
     
@@ -392,13 +1123,25 @@ class RetroVideoApp:
             )
     
     def exit_app(self):
-        """Clean exit"""
-        if self.server_running:
-            try:
-                requests.post('http://127.0.0.1:5000/shutdown', timeout=2)
-            except:
-                pass
-        
+        """Clean exit once running jobs finish; Exit again stops them now"""
+        if draining.is_set():
+            self.exit_deadline = 0
+            return
+        begin_drain()
+        self.exit_deadline = time.time() + DRAIN_TIMEOUT
+        self.status_label.config(text="⏳ Finishing running jobs (Exit again to stop now)", fg='#ffd93d')
+        self.finish_exit()
+    
+    def finish_exit(self):
+        """Poll until the job queue is empty or the drain deadline passes, then quit"""
+        if not job_manager.wait_idle(timeout=0) and time.time() < self.exit_deadline:
+            self.root.after(500, self.finish_exit)
+            return
+        # The server runs on a daemon thread of this process and stops with
+        # it, but ffmpeg runs in its own process group and would not
+        terminate_encodes()
+        disk_janitor.stop()
+        preset_registry.stop()
         self.root.quit()
         self.root.destroy()
         sys.exit()
@@ -414,5 +1157,8 @@ if __name__ == '__main__':
         application_path = sys._MEIPASS
         os.chdir(application_path)
     
+    if tk is None:
+        sys.exit("tkinter is not available; run `python server.py` to serve without the desktop launcher")
+    
     app_instance = RetroVideoApp()
     app_instance.run()
\ No newline at end of file
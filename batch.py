@@ -0,0 +1,308 @@
+# batch.py - Run whole directories of videos through one or more decades
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from oldfilms_filters import (
+    get_decade_filter_config, get_encode_profile, normalize_options, process_video_with_ffmpeg,
+    process_video_multi, probe_video, plan_streams, get_duration, estimate_cost, FilterOptionError
+)
+from metadata import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'webm', 'mkv'}
+MANIFEST_NAME = 'manifest.json'
+# x264 scales poorly past a few threads on small outputs, so a CPU budget is
+# better spent on more files at once than on more threads per file
+DEFAULT_THREADS_PER_JOB = 2
+# How often a batch worker checks whether its job in the server's queue finished
+JOB_POLL_SECONDS = 1
+
+FILE_PENDING = 'pending'
+FILE_RUNNING = 'running'
+FILE_DONE = 'done'
+FILE_FAILED = 'failed'
+FILE_SKIPPED = 'skipped'
+BATCH_STOPPED = 'stopped'
+
+
+def collect_inputs(paths, exclude_dir=None):
+    """Expand files and directories into (input_path, output_stem) pairs
+
+    Directories are walked recursively. Output stems keep the path below the
+    given directory (joined with '__') so same-named files in different
+    folders do not overwrite each other.
+    """
+    exclude_dir = os.path.abspath(exclude_dir) if exclude_dir else None
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != exclude_dir)
+                for name in sorted(files):
+                    if name.rsplit('.', 1)[-1].lower() not in VIDEO_EXTENSIONS:
+                        continue
+                    full_path = os.path.join(root, name)
+                    relative = os.path.relpath(full_path, path)
+                    inputs.append((full_path, os.path.splitext(relative)[0].replace(os.sep, '__')))
+        elif os.path.isfile(path):
+            inputs.append((path, os.path.splitext(os.path.basename(path))[0]))
+        else:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+    return inputs
+
+
+class BatchRunner:
+    """Encode every (file, decade) pair on a worker pool under one CPU budget
+
+    The budget is split into workers x threads per ffmpeg process, and all
+    decades of one input are rendered by a single process. The manifest is
+    rewritten after every file, and outputs only appear under their final
+    name once complete, so rerunning an interrupted batch skips the work
+    that already finished. With a metadata_index, inputs probed before (by
+    an earlier run or the server) are not probed again.
+
+    Inside the server, job_manager is the server's JobManager: every encode
+    is then queued there as a job of its own client, so batches share the
+    encode slots, fair scheduling and drain with web jobs instead of adding
+    their own processes on top, and never run more workers than there are
+    slots.
+    """
+
+    def __init__(self, inputs, decades, output_dir, custom_options=None, encode_profile=None,
+                 cpu_budget=None, threads_per_job=DEFAULT_THREADS_PER_JOB, manifest_path=None, resume=True,
+                 metadata_index=None, job_manager=None):
+        config = get_decade_filter_config()
+        for decade in decades:
+            if decade not in config:
+                raise FilterOptionError(f"Unknown decade: {decade}")
+        if not decades:
+            raise FilterOptionError("At least one decade is required")
+
+        self.output_dir = output_dir
+        self.encode_profile = encode_profile
+        self.metadata_index = metadata_index
+        self.job_manager = job_manager
+        self.manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+        self.cpu_budget = max(1, cpu_budget or os.cpu_count() or 1)
+        self.threads_per_job = max(1, min(threads_per_job, self.cpu_budget))
+        self.workers = max(1, self.cpu_budget // self.threads_per_job)
+        if job_manager is not None:
+            self.workers = min(self.workers, job_manager.max_workers)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        os.makedirs(output_dir, exist_ok=True)
+
+        previous = self._load_manifest() if resume else {}
+        self.options = {}
+        self.profiles = {}
+        self.files = []
+        outputs = set()
+        for input_path, stem in collect_inputs(inputs, exclude_dir=output_dir):
+            for decade in decades:
+                output_path = os.path.join(output_dir, f"{stem}_{decade}.mp4")
+                if output_path in outputs:
+                    raise ValueError(f"Two inputs map to the same output {output_path}")
+                outputs.add(output_path)
+                self.options[decade] = normalize_options(decade, custom_options)
+                self.profiles[decade] = get_encode_profile(decade, encode_profile)
+
+                entry = previous.get(output_path)
+                if resume and os.path.exists(output_path):
+                    entry = dict(entry or {}, status=FILE_SKIPPED)
+                    entry.setdefault('output_size', os.path.getsize(output_path))
+                else:
+                    entry = {'status': FILE_PENDING}
+                entry.update(input=input_path, decade=decade, output=output_path)
+                self.files.append(entry)
+
+        self.manifest = {
+            'status': FILE_PENDING,
+            'decades': list(decades),
+            'encode_profile': encode_profile,
+            'cpu_budget': self.cpu_budget,
+            'workers': self.workers,
+            'threads_per_job': self.threads_per_job,
+            'started_at': None,
+            'finished_at': None,
+            'files': self.files,
+        }
+
+    def _load_manifest(self):
+        """Entries of an earlier manifest for the same output dir, by output path"""
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return {entry['output']: entry for entry in json.load(f).get('files', [])}
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def _write_manifest(self):
+        with self._lock:
+            payload = json.dumps(self.manifest, indent=2, ensure_ascii=False)
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(temp_path, self.manifest_path)
+
+    def _update(self, entry, **fields):
+        with self._lock:
+            entry.update(fields)
+        self._write_manifest()
+
+    def status(self):
+        """Copy of the manifest with a per-status file count"""
+        with self._lock:
+            manifest = json.loads(json.dumps(self.manifest))
+        counts = {}
+        for entry in manifest['files']:
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        manifest['counts'] = counts
+        return manifest
+
+    def _probe(self, input_path):
+        return self.metadata_index.probe(input_path) if self.metadata_index else probe_video(input_path)
+
+    def _encode(self, entries, probe=None):
+        """Encode all pending decades of one input, fanning out from one decode"""
+        input_path = entries[0]['input']
+        probe = probe or self._probe(input_path)
+        plan = plan_streams(probe)
+        duration = get_duration(probe)
+        for entry in entries:
+            self._update(entry, status=FILE_RUNNING, duration=duration, plan=plan, error=None, fanout=len(entries))
+
+        # Encode under temporary names so a crash never leaves a file that a
+        # resumed run would mistake for a finished output
+        temp_paths = {entry['decade']: entry['output'][:-len('.mp4')] + '.part.mp4' for entry in entries}
+        started = time.time()
+        if len(entries) == 1:
+            decade = entries[0]['decade']
+            success, message = process_video_with_ffmpeg(
+                input_path, temp_paths[decade], decade, self.options[decade],
+                probe=probe, plan=plan, encode_profile=self.profiles[decade], threads=self.threads_per_job
+            )
+        else:
+            success, message = process_video_multi(
+                input_path, temp_paths, self.options,
+                probe=probe, plan=plan, encode_profile=self.encode_profile, threads=self.threads_per_job
+            )
+        wall_time = time.time() - started
+
+        for entry in entries:
+            temp_path = temp_paths[entry['decade']]
+            if success:
+                os.replace(temp_path, entry['output'])
+                self._update(
+                    entry,
+                    status=FILE_DONE,
+                    wall_time=round(wall_time, 2),
+                    speed=round(duration / wall_time, 3) if duration and wall_time > 0 else None,
+                    output_size=os.path.getsize(entry['output'])
+                )
+            else:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                self._update(entry, status=FILE_FAILED, wall_time=round(wall_time, 2), error=message)
+            logger.info(f"{entry['status']}: {input_path} ({entry['decade']})")
+        return success, message
+
+    def _run_group(self, entries):
+        """Encode one input's decades here, or as a job in the server's queue"""
+        if self._stop.is_set():
+            # Left pending, so running the batch again picks them up
+            return
+        if self.job_manager is None:
+            self._encode(entries)
+            return
+
+        input_path = entries[0]['input']
+        probe = self._probe(input_path)
+        costs = [
+            estimate_cost(probe, entry['decade'], self.options[entry['decade']], self.profiles[entry['decade']])
+            for entry in entries
+        ] if probe else [None]
+        job_id = self.job_manager.submit(
+            lambda job: self._encode(entries, probe),
+            decade=','.join(entry['decade'] for entry in entries),
+            input_path=input_path,
+            output_path=None,
+            client=f"batch:{os.path.abspath(self.output_dir)}",
+            cost=sum(costs) if None not in costs else None,
+            batch=True
+        )
+        while not self.job_manager.is_finished(job_id):
+            time.sleep(JOB_POLL_SECONDS)
+
+    def stop(self):
+        """Start no further encodes; running ones finish and the rest stay pending"""
+        self._stop.set()
+
+    def run(self):
+        """Encode all pending files and return the final manifest"""
+        self._update(self.manifest, status=FILE_RUNNING, started_at=time.time(), finished_at=None)
+        pending = [entry for entry in self.files if entry['status'] != FILE_SKIPPED]
+        logger.info(
+            f"Batch of {len(pending)} encodes ({len(self.files) - len(pending)} already done) "
+            f"on {self.workers} workers x {self.threads_per_job} threads"
+        )
+        # Decades of the same input share one decode (see process_video_multi)
+        groups = {}
+        for entry in pending:
+            groups.setdefault(entry['input'], []).append(entry)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='oldfilms-batch') as pool:
+            list(pool.map(self._run_group, groups.values()))
+
+        if any(entry['status'] == FILE_FAILED for entry in self.files):
+            status = FILE_FAILED
+        elif any(entry['status'] == FILE_PENDING for entry in self.files):
+            status = BATCH_STOPPED
+        else:
+            status = FILE_DONE
+        self._update(self.manifest, status=status, finished_at=time.time())
+        return self.status()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply decade filters to many videos at once')
+    parser.add_argument('inputs', nargs='+', help='video files or directories (searched recursively)')
+    parser.add_argument('-d', '--decade', action='append', required=True, dest='decades',
+                        help='decade to apply; repeat for several')
+    parser.add_argument('-o', '--output-dir', required=True, help='where outputs and the manifest go')
+    parser.add_argument('--profile', help='encode profile (fast, balanced, archive); default per decade')
+    parser.add_argument('--options', help='custom options as a JSON object')
+    parser.add_argument('--cpu-budget', type=int, help='total threads for the batch (default: all cores)')
+    parser.add_argument('--threads-per-job', type=int, default=DEFAULT_THREADS_PER_JOB)
+    parser.add_argument('--manifest', help=f'manifest path (default: OUTPUT_DIR/{MANIFEST_NAME})')
+    parser.add_argument('--no-resume', action='store_true', help='re-encode outputs that already exist')
+    parser.add_argument('--metadata-index', help='SQLite file that keeps ffprobe results between runs')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        runner = BatchRunner(
+            args.inputs, args.decades, args.output_dir,
+            custom_options=json.loads(args.options) if args.options else None,
+            encode_profile=args.profile,
+            cpu_budget=args.cpu_budget,
+            threads_per_job=args.threads_per_job,
+            manifest_path=args.manifest,
+            resume=not args.no_resume,
+            metadata_index=MetadataIndex(args.metadata_index) if args.metadata_index else None
+        )
+    except (FilterOptionError, ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+
+    manifest = runner.run()
+    print(json.dumps(manifest['counts']))
+    return 1 if manifest['status'] == FILE_FAILED else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
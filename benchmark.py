@@ -0,0 +1,203 @@
+# benchmark.py - Measure every decade chain and encode profile on synthetic inputs
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from oldfilms_filters import (
+    get_decade_filter_config, build_process_command, probe_video, get_video_stream, ENCODE_PROFILES
+)
+
+DEFAULT_HEIGHTS = [480, 720, 1080]
+DEFAULT_DURATIONS = [5]
+DEFAULT_THRESHOLD = 0.10
+WORK_DIR = os.path.join(tempfile.gettempdir(), 'oldfilms_benchmark')
+
+
+def make_input(work_dir, height, duration):
+    """Generate (once) a testsrc2 clip with a sine tone at the given size"""
+    width = height * 16 // 9 // 2 * 2
+    path = os.path.join(work_dir, f'testsrc2_{height}p_{duration}s.mp4')
+    if not os.path.exists(path):
+        cmd = [
+            'ffmpeg', '-v', 'error',
+            '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate=30:duration={duration}',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-shortest', '-y', path
+        ]
+        subprocess.run(cmd, check=True)
+    return path
+
+
+def run_measured(cmd):
+    """Run a command, returning (returncode, wall seconds, CPU seconds, peak RSS in MB)
+
+    CPU time and peak RSS come from os.wait4 and are None where it is not
+    available (Windows).
+    """
+    with tempfile.TemporaryFile() as stderr:
+        started = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            wall = time.perf_counter() - started
+            # Let Popen know the child is gone
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            cpu_time = usage.ru_utime + usage.ru_stime
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        else:
+            proc.wait()
+            wall = time.perf_counter() - started
+            cpu_time = peak_rss = None
+        if proc.returncode != 0:
+            stderr.seek(0)
+            sys.stderr.write(stderr.read().decode('utf-8', 'replace')[-2000:])
+    return proc.returncode, wall, cpu_time, peak_rss
+
+
+def benchmark_case(input_path, duration, decade, profile, work_dir, repeat):
+    """Best of repeat runs of one decade/profile on one input"""
+    probe = probe_video(input_path)
+    output_path = os.path.join(work_dir, f'out_{decade}_{profile}.mp4')
+    cmd = build_process_command(input_path, output_path, decade, probe=probe, encode_profile=profile)
+    # Keep the encoder quiet; progress output is not needed here
+    cmd = [cmd[0], '-v', 'error', '-nostats'] + cmd[1:]
+
+    runs = [run_measured(cmd) for _ in range(repeat)]
+    if any(returncode != 0 for returncode, _, _, _ in runs):
+        return {'error': 'ffmpeg failed'}
+
+    _, wall, cpu_time, peak_rss = min(runs, key=lambda run: run[1])
+
+    # Fixed cost every job pays however short its input: process start,
+    # demuxer, filter graph and encoder init, and the first frame
+    setup_path = os.path.join(work_dir, f'setup_{decade}_{profile}.mp4')
+    setup_cmd = cmd[:-2] + ['-frames:v', '1', '-y', setup_path]
+    setup = min(run_measured(setup_cmd)[1] for _ in range(max(repeat, 3)))
+    if os.path.exists(setup_path):
+        os.remove(setup_path)
+
+    output_stream = get_video_stream(probe_video(output_path)) or {}
+    frames = int(output_stream.get('nb_frames') or 0)
+    result = {
+        'wall_time': round(wall, 3),
+        'fps': round(frames / wall, 1) if wall > 0 else None,
+        'x_realtime': round(duration / wall, 3) if wall > 0 else None,
+        'setup_time': round(setup, 3),
+        'setup_share': round(setup / wall, 3) if wall > 0 else None,
+        'cpu_time': round(cpu_time, 3) if cpu_time is not None else None,
+        'peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None,
+        'frames': frames,
+        'output_size': os.path.getsize(output_path),
+    }
+    os.remove(output_path)
+    return result
+
+
+def case_key(case):
+    return (case['decade'], case['profile'], case['height'], case['duration'])
+
+
+def compare(results, baseline, threshold):
+    """Cases whose wall time grew by more than threshold against the baseline"""
+    previous = {case_key(case): case for case in baseline['results'] if 'wall_time' in case}
+    regressions = []
+    for case in results['results']:
+        old = previous.get(case_key(case))
+        if not old or 'wall_time' not in case:
+            continue
+        change = case['wall_time'] / old['wall_time'] - 1
+        case['baseline_wall_time'] = old['wall_time']
+        case['change'] = round(change, 3)
+        if change > threshold:
+            regressions.append(case)
+    return regressions
+
+
+def ffmpeg_version():
+    try:
+        output = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout
+        return output.splitlines()[0] if output else None
+    except OSError:
+        return None
+
+
+def parse_list(value, convert=str):
+    return [convert(item) for item in value.split(',') if item]
+
+
+def main(argv=None):
+    decades = list(get_decade_filter_config())
+    parser = argparse.ArgumentParser(description='Benchmark decade filter chains and encode profiles')
+    parser.add_argument('--heights', default=','.join(map(str, DEFAULT_HEIGHTS)),
+                        help='comma-separated input heights (16:9)')
+    parser.add_argument('--durations', default=','.join(map(str, DEFAULT_DURATIONS)),
+                        help='comma-separated input durations in seconds')
+    parser.add_argument('--decades', default=','.join(decades))
+    parser.add_argument('--profiles', default=','.join(ENCODE_PROFILES))
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case; the fastest is kept')
+    parser.add_argument('--work-dir', default=WORK_DIR, help='where test inputs are generated and reused')
+    parser.add_argument('-o', '--output', help='write results JSON here (default: stdout)')
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed wall time growth before a case counts as a regression')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = {
+        'meta': {
+            'ffmpeg': ffmpeg_version(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat,
+        },
+        'results': [],
+    }
+
+    for height in parse_list(args.heights, int):
+        for duration in parse_list(args.durations, float):
+            input_path = make_input(args.work_dir, height, duration)
+            for decade in parse_list(args.decades):
+                for profile in parse_list(args.profiles):
+                    case = {'decade': decade, 'profile': profile, 'height': height, 'duration': duration}
+                    case.update(benchmark_case(input_path, duration, decade, profile, args.work_dir, args.repeat))
+                    results['results'].append(case)
+                    print(
+                        f"{decade} {profile:8} {height}p {duration:g}s: "
+                        f"{case.get('fps')} fps, {case.get('x_realtime')}x realtime, "
+                        f"{case.get('peak_rss_mb')} MB, {case.get('setup_time')}s setup",
+                        file=sys.stderr
+                    )
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        results['regressions'] = [case_key(case) for case in regressions]
+        for case in regressions:
+            print(
+                f"REGRESSION {case['decade']} {case['profile']} {case['height']}p: "
+                f"{case['baseline_wall_time']}s -> {case['wall_time']}s ({case['change']:+.0%})",
+                file=sys.stderr
+            )
+
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(payload)
+    else:
+        print(payload)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
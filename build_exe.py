@@ -43,6 +43,7 @@ def build_executable():
         # 修改：使用绝对路径来确保PyInstaller能找到目录
         f'--add-data={os.path.join(source_dir, "templates")};templates',
         f'--add-data={os.path.join(source_dir, "static")};static',
+        f'--add-data={os.path.join(source_dir, "presets")};presets',
         f'--add-data={os.path.join(source_dir, "uploads")};uploads',
         f'--add-data={os.path.join(source_dir, "processed")};processed',
         '--hidden-import=flask',
@@ -0,0 +1,238 @@
+# chunked_uploads.py - Resumable uploads sent in checksummed chunks, stored once per content hash
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+
+from result_cache import hash_file
+from janitor import sharded_path
+
+logger = logging.getLogger(__name__)
+
+# Small enough that a dropped connection on a phone loses little, large
+# enough that a 2 GB file is a few hundred requests
+CHUNK_BYTES = 8 * 1024 * 1024
+
+SESSION_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# A SHA-256 sent by the client, in either case
+CONTENT_HASH_PATTERN = re.compile(r'^[0-9a-fA-F]{64}$')
+
+
+class UploadError(ValueError):
+    """A chunked upload request that cannot be accepted as sent"""
+
+
+class ChunkedUploadStore:
+    """Chunked uploads written in place, then kept once per content hash
+
+    A session preallocates its file and records which chunks have arrived
+    in a JSON file next to it, so a client that lost its connection (or a
+    restarted server) can ask which chunks are missing and send only those.
+    Every chunk carries a CRC-32 that is checked before it is written at its
+    offset. Finalizing hashes the whole file and moves it into the store
+    under its SHA-256, which is the upload id used to process it; if that
+    content is already stored the new copy is dropped, and a client that
+    knows the hash up front skips the upload entirely.
+    """
+
+    def __init__(self, partial_folder, store_folder, max_bytes=None, chunk_bytes=CHUNK_BYTES):
+        self.partial_folder = partial_folder
+        self.store_folder = store_folder
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self._lock = threading.Lock()
+        os.makedirs(partial_folder, exist_ok=True)
+        os.makedirs(store_folder, exist_ok=True)
+
+    def path(self, upload_id):
+        """Stored file for an upload id, or None if it is unknown"""
+        if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+            return None
+        shard = os.path.dirname(sharded_path(self.store_folder, upload_id))
+        for name in os.listdir(shard):
+            if name.split('.', 1)[0] == upload_id:
+                path = os.path.join(shard, name)
+                try:
+                    # Reuse counts as use for the janitor's TTL
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+        return None
+
+    def _session_paths(self, session_id):
+        if not SESSION_ID_PATTERN.match(session_id or ''):
+            return None, None
+        data_path = sharded_path(self.partial_folder, f'{session_id}.part')
+        return data_path, data_path[:-len('.part')] + '.json'
+
+    def _load(self, session_id):
+        """A session's state, or None if it is unknown or its data was removed"""
+        data_path, state_path = self._session_paths(session_id)
+        if state_path is None:
+            return None
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not session.get('upload_id') and not os.path.exists(data_path):
+            # Expired by the janitor; the client has to start over
+            return None
+        return session
+
+    def _save(self, session):
+        _, state_path = self._session_paths(session['session_id'])
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, state_path)
+
+    def _public(self, session):
+        return {
+            'upload_id': session.get('upload_id') or session['session_id'],
+            'complete': bool(session.get('upload_id')),
+            'size': session['size'],
+            'chunk_size': session['chunk_bytes'],
+            'chunks': session['chunks'],
+            'received': sorted(session['received']),
+        }
+
+    def active_paths(self, max_idle):
+        """Files of sessions still open and touched within max_idle seconds
+
+        Reported to the janitor as in use, so a session that is still being
+        sent is never evicted halfway; idle ones expire with the uploads TTL.
+        """
+        cutoff = time.time() - max_idle
+        paths = set()
+        for root, _, files in os.walk(self.partial_folder):
+            for name in files:
+                if not name.endswith('.part'):
+                    continue
+                data_path = os.path.join(root, name)
+                state_path = data_path[:-len('.part')] + '.json'
+                try:
+                    touched = max(os.path.getmtime(data_path), os.path.getmtime(state_path))
+                except OSError:
+                    continue
+                if touched >= cutoff:
+                    paths.update((data_path, state_path))
+        return paths
+
+    def start(self, filename, size, content_hash=None):
+        """Open a session for a file; already stored content completes at once"""
+        if '.' not in (filename or ''):
+            raise UploadError('filename needs an extension')
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise UploadError('size must be a positive number of bytes')
+        if self.max_bytes and size > self.max_bytes:
+            raise UploadError(f'Upload exceeds {self.max_bytes // (1024 * 1024)} MB')
+        if content_hash is not None and not (
+            isinstance(content_hash, str) and CONTENT_HASH_PATTERN.fullmatch(content_hash)
+        ):
+            raise UploadError('sha256 must be 64 hexadecimal digits')
+
+        if content_hash:
+            stored = self.path(content_hash.lower())
+            if stored and os.path.getsize(stored) == size:
+                logger.info(f"Upload {content_hash[:12]} already stored, skipping it")
+                return {'upload_id': content_hash.lower(), 'complete': True, 'size': size}
+
+        session = {
+            'session_id': uuid.uuid4().hex,
+            'extension': filename.rsplit('.', 1)[1].lower(),
+            'size': size,
+            'chunk_bytes': self.chunk_bytes,
+            'chunks': -(-size // self.chunk_bytes),
+            'received': [],
+            'created_at': time.time(),
+        }
+        data_path, _ = self._session_paths(session['session_id'])
+        with open(data_path, 'wb') as f:
+            # Chunks may arrive in any order, each at its own offset
+            f.truncate(size)
+        with self._lock:
+            self._save(session)
+        return self._public(session)
+
+    def status(self, session_id):
+        """Progress of a session (which chunks arrived), or None if it is unknown or expired"""
+        session = self._load(session_id)
+        return self._public(session) if session else None
+
+    def put_chunk(self, session_id, index, data, crc32):
+        """Check and write one chunk; returns the session status, or None if unknown or expired"""
+        session = self._load(session_id)
+        if session is None:
+            return None
+        if session.get('upload_id'):
+            return self._public(session)
+        if not 0 <= index < session['chunks']:
+            raise UploadError(f'Chunk {index} is out of range')
+        offset = index * session['chunk_bytes']
+        expected = min(session['chunk_bytes'], session['size'] - offset)
+        if len(data) != expected:
+            raise UploadError(f'Chunk {index} has {len(data)} bytes, expected {expected}')
+        try:
+            crc_matches = int(crc32 or '', 16) == zlib.crc32(data)
+        except ValueError:
+            crc_matches = False
+        if not crc_matches:
+            raise UploadError(f'Chunk {index} failed its checksum, send it again')
+
+        data_path, _ = self._session_paths(session_id)
+        try:
+            with open(data_path, 'r+b') as f:
+                f.seek(offset)
+                f.write(data)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            session = self._load(session_id)
+            if session is None:
+                return None
+            if index not in session['received']:
+                session['received'].append(index)
+                self._save(session)
+        return self._public(session)
+
+    def finalize(self, session_id):
+        """Store a fully received upload under its content hash
+
+        Returns the status with the upload id (the content hash) and whether
+        the content was already stored, or None for an unknown or expired
+        session.
+        """
+        with self._lock:
+            session = self._load(session_id)
+            if session is None:
+                return None
+            if session.get('upload_id'):
+                # Finalized before; the client did not get the answer
+                return dict(self._public(session), duplicate=session.get('duplicate', False))
+            missing = session['chunks'] - len(session['received'])
+            if missing:
+                raise UploadError(f'{missing} chunks are still missing')
+
+            data_path, _ = self._session_paths(session_id)
+            try:
+                upload_id = hash_file(data_path)
+            except FileNotFoundError:
+                return None
+            duplicate = self.path(upload_id) is not None
+            if duplicate:
+                os.remove(data_path)
+            else:
+                os.replace(data_path, sharded_path(self.store_folder, f"{upload_id}.{session['extension']}"))
+            session.update(upload_id=upload_id, duplicate=duplicate)
+            self._save(session)
+        logger.info(f"Upload {upload_id[:12]} finalized{' (already stored)' if duplicate else ''}")
+        return dict(self._public(session), duplicate=duplicate)
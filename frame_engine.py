@@ -0,0 +1,315 @@
+# frame_engine.py - Optional NumPy effects for options plain ffmpeg filters cannot express
+
+import logging
+import os
+import queue
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import textures
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = np is not None
+# OLDFILMS_FRAME_ENGINE=0 keeps every job on the pure-ffmpeg path
+ENABLED = AVAILABLE and os.environ.get('OLDFILMS_FRAME_ENGINE', '1') != '0'
+
+PIXEL_FORMAT = 'rgb24'
+# Each of the two frame buffers holds at most this many bytes of frames
+BATCH_BYTES = 16 * 1024 * 1024
+MAX_BATCH_FRAMES = 16
+
+# Option -> effect; number options are active above zero, flags when set,
+# and only when the job changed them from the preset's default (see
+# active_effects)
+ENGINE_OPTIONS = {
+    'scratches_level': 'scratches',
+    'light_leaks': 'light_leaks',
+    'handheld_shake': 'handheld_shake',
+    'tracking_issues': 'tracking_issues',
+    'auto_focus_enabled': 'auto_focus',
+    'zoom_artifacts': 'zoom_artifacts',
+}
+
+# Order effects run in: camera first (zoom, shake, focus), then the medium
+EFFECT_ORDER = ('zoom_artifacts', 'handheld_shake', 'auto_focus', 'light_leaks', 'tracking_issues', 'scratches')
+
+# Warm orange added by light leaks, per RGB channel
+LEAK_COLOR = (255, 140, 40)
+
+
+def active_effects(options, defaults=None):
+    """Effects requested by normalized options, in the order they run
+
+    With defaults (the preset's normalized defaults), options left at their
+    default request nothing: presets such as the 1900s scratches or the
+    1990s auto focus declare engine options that are on by default, and a
+    job that does not touch them stays on the plain ffmpeg path.
+    """
+    defaults = defaults or {}
+    requested = {
+        effect for key, effect in ENGINE_OPTIONS.items()
+        if options.get(key) and options.get(key) != defaults.get(key)
+    }
+    return [effect for effect in EFFECT_ORDER if effect in requested]
+
+
+def _read_frames(stream, buffer):
+    """Fill buffer with whole frames from stream; returns the number read"""
+    view = memoryview(buffer.reshape(-1))
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return filled // (buffer.nbytes // len(buffer))
+
+
+class FrameEngine:
+    """Apply vectorized effects to batches of raw RGB frames
+
+    Frames are read from a rawvideo pipe into one of two preallocated
+    batch buffers by a reader thread while the other buffer is processed
+    and written out, so memory stays at two batches plus a few single-frame
+    scratch buffers however long the video is. Random choices come from a
+    fixed seed, so the same input and options always give the same output.
+    """
+
+    def __init__(self, width, height, fps, options, seed=0, batch_frames=None, texture_cache=None, defaults=None):
+        if not AVAILABLE:
+            raise RuntimeError("The frame engine needs numpy")
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.options = options
+        self.effects = active_effects(options, defaults)
+        self.frame_index = 0
+        self._rng = np.random.default_rng(seed)
+
+        frame_bytes = width * height * 3
+        self.batch_frames = batch_frames or max(1, min(MAX_BATCH_FRAMES, BATCH_BYTES // frame_bytes))
+        shape = (self.batch_frames, height, width, 3)
+        self._buffers = [np.empty(shape, np.uint8) for _ in range(2)]
+        self._frame_tmp = np.empty((height, width, 3), np.uint8)
+        self._frame_tmp2 = np.empty((height, width, 3), np.uint8)
+        self._columns = np.arange(width)
+        self._rows = np.arange(height)
+
+        # Textures that do not depend on the frame content come from atlases
+        texture_cache = texture_cache or textures.get_texture_cache()
+        self._leak_masks = None
+        if 'light_leaks' in self.effects:
+            self._leak_masks = texture_cache.get('leak', width, height)['masks']
+            _, small_height, small_width = self._leak_masks.shape
+            full = (small_height * textures.LEAK_SCALE, small_width * textures.LEAK_SCALE, 3)
+            self._leak_add = np.empty(full, np.uint8)
+            self._leak_room = np.empty(full, np.uint8)
+        self._dust = None
+        if 'scratches' in self.effects:
+            level = int(options.get('scratches_level') or 0)
+            self._dust = texture_cache.get('dust', width, height, level)
+
+        # Effect state carried from frame to frame
+        self._events = {}
+        self._shake = np.zeros(2)
+        self._scratches = np.empty((0, 3))
+
+    def frames(self, stream):
+        """Yield processed batches (as uint8 arrays) read from a rawvideo stream
+
+        Each yielded array is only valid until the next one is requested.
+        """
+        free = queue.Queue()
+        for buffer in self._buffers:
+            free.put(buffer)
+        full = queue.Queue()
+        stop = threading.Event()
+
+        def read_batches():
+            try:
+                while not stop.is_set():
+                    try:
+                        buffer = free.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    count = _read_frames(stream, buffer)
+                    full.put((buffer, count))
+                    if count < len(buffer):
+                        break
+            except (OSError, ValueError) as e:
+                logger.warning(f"Frame reader stopped: {e}")
+            finally:
+                full.put(None)
+
+        reader = threading.Thread(target=read_batches, name='oldfilms-frame-reader', daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = full.get()
+                if item is None:
+                    break
+                buffer, count = item
+                if count:
+                    batch = buffer[:count]
+                    self.process(batch)
+                    yield batch
+                free.put(buffer)
+        finally:
+            stop.set()
+
+    def process(self, batch):
+        """Apply every active effect to a batch of frames in place"""
+        for effect in self.effects:
+            getattr(self, f'_apply_{effect}')(batch)
+        self.frame_index += len(batch)
+
+    def _event(self, name, count, every_seconds, length_seconds):
+        """Progress (0..1) of a recurring random event for each of count frames, or None when idle"""
+        progress = []
+        remaining, length = self._events.get(name, (0, 1))
+        for _ in range(count):
+            if remaining == 0 and self._rng.random() < 1 / max(1.0, every_seconds * self.fps):
+                length = max(2, int(length_seconds * self.fps))
+                remaining = length
+            if remaining:
+                progress.append(1 - remaining / length)
+                remaining -= 1
+            else:
+                progress.append(None)
+        self._events[name] = (remaining, length)
+        return progress
+
+    def _apply_scratches(self, batch):
+        level = float(self.options.get('scratches_level') or 0)
+        count, width = len(batch), self.width
+
+        # Vertical scratches live for a few frames and wander sideways
+        line_width = max(1, width // 320)
+        for frame in batch:
+            if len(self._scratches):
+                self._scratches[:, 0] += self._rng.normal(0, 1.5, len(self._scratches))
+                self._scratches[:, 1] -= 1
+                self._scratches = self._scratches[self._scratches[:, 1] > 0]
+            wanted = self._rng.poisson(level / 20)
+            if wanted > len(self._scratches):
+                born = wanted - len(self._scratches)
+                new = np.column_stack([
+                    self._rng.uniform(0, width, born),
+                    self._rng.integers(2, 8, born),
+                    self._rng.choice([40, 220], born),
+                ])
+                self._scratches = np.vstack([self._scratches, new])
+            if len(self._scratches):
+                columns = (self._scratches[:, 0].astype(int)[:, None] + np.arange(line_width)) % width
+                shades = np.repeat(self._scratches[:, 2], line_width).astype(np.uint8)
+                frame[:, columns.ravel(), :] = shades[None, :, None]
+
+        # Dust and dirt: dark or bright specks from a random plate of the atlas
+        plates = self._rng.integers(0, len(self._dust['indices']), count)
+        indices = self._dust['indices'][plates]
+        frame_ids = np.repeat(np.arange(count), indices.shape[1])
+        batch.reshape(count, -1, 3)[frame_ids, indices.ravel()] = self._dust['shades'][plates].reshape(-1, 1)
+
+    def _upscale(self, small, out):
+        """Nearest-neighbour upscale by LEAK_SCALE into out, returning the frame-sized view"""
+        scale = textures.LEAK_SCALE
+        height, width = small.shape[:2]
+        out.reshape(height, scale, width, scale, 3)[...] = small[:, None, :, None, :]
+        return out[:self.height, :self.width]
+
+    def _apply_light_leaks(self, batch):
+        color = np.array(LEAK_COLOR, np.float32) / 255
+        levels = np.arange(256, dtype=np.float32)[:, None]
+        for i, frame in enumerate(batch):
+            t = (self.frame_index + i) / self.fps
+            strength = max(0.0, np.sin(t * 0.9) * np.sin(t * 0.37 + 1.0)) * 0.55
+            if strength < 0.02:
+                continue
+            position = int(t / textures.LEAK_LOOP_SECONDS * len(self._leak_masks)) % len(self._leak_masks)
+            # Strength and colour go through a lookup table on the small mask
+            table = (levels * color * strength).astype(np.uint8)
+            small = table[self._leak_masks[position]]
+            add = self._upscale(small, self._leak_add)
+            room = self._upscale(255 - small, self._leak_room)
+            # Saturating add in uint8: clip to the headroom first
+            np.minimum(frame, room, out=frame)
+            frame += add
+
+    def _shift(self, frame, dx, dy):
+        """Move a frame by whole pixels, leaving the uncovered edge as it was"""
+        height, width = self.height, self.width
+        np.copyto(self._frame_tmp, frame)
+        frame[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+            self._frame_tmp[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+
+    def _apply_handheld_shake(self, batch):
+        amplitude = self.height / 180
+        for frame in batch:
+            # A damped random walk wobbles like a hand, not like noise
+            self._shake = self._shake * 0.85 + self._rng.normal(0, 0.6, 2)
+            dx, dy = (self._shake * amplitude).round().astype(int)
+            if dx or dy:
+                self._shift(frame, int(dx), int(dy))
+
+    def _apply_tracking_issues(self, batch):
+        height, width = self.height, self.width
+        band_height = max(4, height // 12)
+        for i, progress in enumerate(self._event('tracking', len(batch), 4, 0.6)):
+            if progress is None:
+                continue
+            frame = batch[i]
+            top = int(height * 0.78 + self._rng.integers(-band_height, band_height))
+            top = min(max(0, top), height - band_height)
+            band = frame[top:top + band_height]
+
+            # Rows slide sideways by different amounts, like a mistracked tape
+            rows = np.arange(band_height)
+            offsets = (np.sin(rows * 0.35 + progress * 25) * width * 0.03
+                       + self._rng.normal(0, width * 0.004, band_height)).astype(int)
+            index = (self._columns[None, :] - offsets[:, None]) % width
+            shifted = np.take_along_axis(band, index[:, :, None], axis=1)
+
+            # Bright dropout streaks
+            streaks = self._rng.random((band_height, width)) > 0.985
+            shifted[streaks] = 235
+            band[...] = shifted
+
+    def _box_blur(self, frame, radius):
+        """Separable box blur through running sums"""
+        size = 2 * radius + 1
+        padded = np.pad(frame, ((radius + 1, radius), (radius + 1, radius), (0, 0)), mode='edge')
+        sums = padded.cumsum(axis=0, dtype=np.uint32)
+        sums = sums[size:] - sums[:-size]
+        sums = sums.cumsum(axis=1, dtype=np.uint32)
+        sums = sums[:, size:] - sums[:, :-size]
+        np.floor_divide(sums, size * size, out=sums)
+        np.copyto(frame, sums, casting='unsafe')
+
+    def _apply_auto_focus(self, batch):
+        max_radius = max(1, self.height // 120)
+        for i, progress in enumerate(self._event('focus', len(batch), 5, 0.8)):
+            if progress is None:
+                continue
+            # The lens drifts out of focus and hunts back
+            radius = int(round(max_radius * np.sin(np.pi * progress)))
+            if radius:
+                self._box_blur(batch[i], radius)
+
+    def _apply_zoom_artifacts(self, batch):
+        height, width = self.height, self.width
+        for i, progress in enumerate(self._event('zoom', len(batch), 8, 2.0)):
+            if progress is None:
+                continue
+            zoom = 1 + 0.6 * np.sin(np.pi * progress)
+            # Digital zoom: nearest-neighbour upscaling in coarse blocks
+            block = max(1, int(zoom * 2) - 1)
+            rows = ((self._rows - height / 2) / zoom + height / 2).astype(int) // block * block
+            columns = ((self._columns - width / 2) / zoom + width / 2).astype(int) // block * block
+            np.copyto(self._frame_tmp, batch[i])
+            np.take(self._frame_tmp, np.clip(rows, 0, height - 1), axis=0, out=self._frame_tmp2)
+            np.take(self._frame_tmp2, np.clip(columns, 0, width - 1), axis=1, out=batch[i])
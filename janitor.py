@@ -0,0 +1,111 @@
+# janitor.py - Keeps uploads/ and processed/ within their TTLs and a disk quota
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Files are spread over subdirectories named after the first characters of
+# their id, so no single directory grows to tens of thousands of entries
+SHARD_CHARS = 2
+
+
+def sharded_path(folder, name, key=None):
+    """Path of name inside the shard of folder chosen by key (default: name)"""
+    shard = os.path.join(folder, (key or name)[:SHARD_CHARS])
+    os.makedirs(shard, exist_ok=True)
+    return os.path.join(shard, name)
+
+
+class DiskJanitor:
+    """Delete expired files and enforce a total byte quota in the background
+
+    areas maps a folder to its TTL in seconds. A sweep first removes files
+    whose mtime is older than their area's TTL, then, while all areas
+    together exceed max_bytes, removes files oldest mtime first. Downloads
+    and cache hits bump the mtime, so that is least recently used first.
+    Folders nested inside an area that are areas themselves, or listed in
+    exclude, are left to their own rules; paths returned by in_use() are
+    never touched. on_sweep, if given, runs after every background sweep,
+    for in-memory records that should expire along with the files.
+    """
+
+    def __init__(self, areas, max_bytes=None, interval=600, in_use=None, exclude=(), on_sweep=None):
+        self.areas = {os.path.abspath(folder): ttl for folder, ttl in areas.items()}
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.in_use = in_use or (lambda: set())
+        self.on_sweep = on_sweep
+        self._skip = set(self.areas) | {os.path.abspath(folder) for folder in exclude}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='oldfilms-janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+                if self.on_sweep:
+                    self.on_sweep()
+            except Exception:
+                logger.exception("Disk sweep failed")
+
+    def _scan(self, folder):
+        """(mtime, size, path) of every file below folder, skipping nested areas"""
+        entries = []
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in self._skip]
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError as e:
+            # Usually a file that is still being downloaded on Windows
+            logger.warning(f"Could not remove {path}: {e}")
+            return False
+
+    def sweep(self):
+        """Run one cleanup pass and return (files removed, bytes freed)"""
+        now = time.time()
+        in_use = {os.path.abspath(path) for path in self.in_use() if path}
+        removed, freed, busy_bytes = 0, 0, 0
+        remaining = []
+        for folder, ttl in self.areas.items():
+            for mtime, size, path in self._scan(folder):
+                if os.path.abspath(path) in in_use:
+                    busy_bytes += size
+                    continue
+                if ttl is not None and now - mtime > ttl and self._remove(path):
+                    removed, freed = removed + 1, freed + size
+                else:
+                    remaining.append((mtime, size, path))
+
+        total = busy_bytes + sum(size for _, size, _ in remaining)
+        if self.max_bytes is not None:
+            for mtime, size, path in sorted(remaining):
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    removed, freed, total = removed + 1, freed + size, total - size
+
+        if removed:
+            logger.info(f"Disk sweep removed {removed} files ({freed / 1024 / 1024:.1f} MB)")
+        return removed, freed
@@ -0,0 +1,288 @@
+# jobs.py - Background job queue for video processing
+
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Keep half the cores for ffmpeg's own threading by default
+DEFAULT_MAX_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Fields that stay on the server and are never sent to the browser
+PRIVATE_FIELDS = ('input_path', 'output_path', 'cache_key', 'input_hash', 'client')
+
+# Cost charged for jobs whose cost could not be estimated (e.g. probe failed)
+DEFAULT_COST = 60.0
+# A waiting job's priority improves by this many estimated seconds per second
+# waited, so long jobs are delayed by short ones but never starved
+AGING_RATE = 0.5
+# Weight of each finished job in the learned seconds-per-cost rate
+RATE_SMOOTHING = 0.2
+
+
+class JobManager:
+    """Run processing jobs on a bounded worker pool and track their status
+
+    Queued jobs are not run first come, first served. Each job carries a
+    cost estimate and the client that submitted it; clients share the
+    workers fairly by the cost they have used (weighted fair queuing), and
+    the next job is the one that would finish first in that virtual time,
+    so short jobs go ahead of long ones. Seconds of cost are turned into
+    wall-clock estimates by a rate learned from finished jobs, which gives
+    the backlog used for admission control.
+    """
+
+    def __init__(self, max_workers=None, on_finish=None, max_backlog=None):
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        # Called with a copy of every job record that finishes running
+        self.on_finish = on_finish
+        # Estimated seconds of queued work per worker beyond which new
+        # jobs are turned away (see retry_after); None admits everything
+        self.max_backlog = max_backlog
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='oldfilms-job'
+        )
+        # Encode slots are shared by pool workers and jobs started inline with
+        # try_start, so the total number of running encodes stays bounded
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Queued jobs per client, and each client's virtual finish time
+        self._pending = {}
+        self._client_finish = {}
+        self._virtual_time = 0.0
+        # Wall-clock seconds per second of estimated cost on this machine
+        self._seconds_per_cost = 1.0
+
+    def _create(self, status, info):
+        job = dict(info)
+        job.setdefault('client', None)
+        job.setdefault('cost', None)
+        job.update({
+            'id': str(uuid.uuid4()),
+            'status': status,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+        })
+        with self._lock:
+            self._jobs[job['id']] = job
+        return job
+
+    def submit(self, target, **info):
+        """Queue target(job) -> (success, message) and return the new job id
+
+        info may carry the submitting client and the job's estimated cost
+        (see oldfilms_filters.estimate_cost), which decide when it runs.
+        """
+        job = self._create(JOB_QUEUED, info)
+        with self._lock:
+            job['estimated_seconds'] = self._estimate_seconds(job)
+            clients = self._pending.setdefault(job['client'], [])
+            if not clients:
+                # A client that was idle starts level with the others
+                start = max(self._client_finish.get(job['client'], 0.0), self._virtual_time)
+                self._client_finish[job['client']] = start
+            clients.append((job, target))
+        # Every queued job gets one pool task, which runs whichever job is
+        # due when a worker frees up, not necessarily this one
+        self._executor.submit(self._run_next)
+        logger.info(f"Queued job {job['id']} (estimated {job['estimated_seconds']}s)")
+        return job['id']
+
+    def try_start(self, target, **info):
+        """Start target(job) on its own thread if an encode slot is free
+
+        Returns the job id, or None when every slot is busy.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+        job = self._create(JOB_RUNNING, info)
+        job['started_at'] = job['created_at']
+        threading.Thread(target=self._execute, args=(job, target), daemon=True).start()
+        logger.info(f"Started job {job['id']} inline")
+        return job['id']
+
+    def add_done(self, **info):
+        """Record a job whose result already exists, without running anything"""
+        job = self._create(JOB_DONE, info)
+        job['started_at'] = job['finished_at'] = job['created_at']
+        return job['id']
+
+    def _job_cost(self, job):
+        return job['cost'] if job.get('cost') is not None else DEFAULT_COST
+
+    def _estimate_seconds(self, job):
+        return round(self._job_cost(job) * self._seconds_per_cost, 1)
+
+    def _pop_next(self):
+        """Remove and return the (job, target) due to run next; caller holds the lock"""
+        now = time.time()
+        best = None
+        for client, pending in self._pending.items():
+            # Within a client: shortest first, with waiting time counted in
+            index = min(
+                range(len(pending)),
+                key=lambda i: self._job_cost(pending[i][0])
+                - AGING_RATE * (now - pending[i][0]['created_at']) / self._seconds_per_cost
+            )
+            start = max(self._client_finish.get(client, 0.0), self._virtual_time)
+            finish = start + self._job_cost(pending[index][0])
+            if best is None or finish < best[0]:
+                best = (finish, start, client, index)
+
+        finish, start, client, index = best
+        job, target = self._pending[client].pop(index)
+        if not self._pending[client]:
+            del self._pending[client]
+        self._client_finish[client] = finish
+        self._virtual_time = start
+        # Forget finish times that can no longer matter
+        for idle in [c for c, t in self._client_finish.items() if t <= start and c not in self._pending]:
+            del self._client_finish[idle]
+        return job, target
+
+    def _run_next(self):
+        self._slots.acquire()
+        with self._lock:
+            job, target = self._pop_next()
+            job.update(status=JOB_RUNNING, started_at=time.time())
+        self._execute(job, target)
+
+    def _execute(self, job, target):
+        """Run a job that already holds an encode slot, then release it"""
+        try:
+            success, message = target(job)
+        except Exception as e:
+            logger.exception(f"Job {job['id']} crashed")
+            success, message = False, str(e)
+
+        if success:
+            self.update(job['id'], status=JOB_DONE, finished_at=time.time())
+            self._learn_rate(job)
+        else:
+            self.update(job['id'], status=JOB_FAILED, error=message, finished_at=time.time())
+        self._slots.release()
+        logger.info(f"Job {job['id']} finished: {job['status']}")
+        if self.on_finish:
+            try:
+                self.on_finish(self.get(job['id']))
+            except Exception:
+                logger.exception(f"Finish hook failed for job {job['id']}")
+
+    def _learn_rate(self, job):
+        """Move the seconds-per-cost rate towards what a finished job took"""
+        if not job.get('cost'):
+            return
+        with self._lock:
+            observed = (job['finished_at'] - job['started_at']) / job['cost']
+            # One odd job (a stalled upload, a cache of warm disks) moves it only so far
+            observed = min(max(observed, self._seconds_per_cost / 10), self._seconds_per_cost * 10)
+            self._seconds_per_cost += RATE_SMOOTHING * (observed - self._seconds_per_cost)
+
+    def update(self, job_id, **fields):
+        """Update fields of a job record in place"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def is_finished(self, job_id):
+        job = self.get(job_id)
+        return job is None or job['status'] in (JOB_DONE, JOB_FAILED)
+
+    def get(self, job_id):
+        """Return a copy of the job record, or None for unknown ids"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def find_active(self, **match):
+        """Copy of a queued or running job whose fields equal match, or None"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job['status'] in (JOB_QUEUED, JOB_RUNNING) and all(job.get(k) == v for k, v in match.items()):
+                    return dict(job)
+        return None
+
+    def to_public(self, job):
+        """Strip server-side fields before a job is serialized for clients"""
+        return {k: v for k, v in job.items() if k not in PRIVATE_FIELDS}
+
+    def active_paths(self):
+        """Input and output files of queued or running jobs"""
+        with self._lock:
+            return {
+                job.get(field)
+                for job in self._jobs.values() if job['status'] in (JOB_QUEUED, JOB_RUNNING)
+                for field in ('input_path', 'output_path')
+            }
+
+    def expire(self, max_age):
+        """Forget finished jobs older than max_age seconds; returns how many"""
+        cutoff = time.time() - max_age
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job['status'] in (JOB_DONE, JOB_FAILED) and job['finished_at'] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def running_count(self):
+        """Number of jobs currently encoding"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] == JOB_RUNNING)
+
+    def queue_depth(self):
+        """Number of jobs waiting for a free worker"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] == JOB_QUEUED)
+
+    def estimate_seconds(self, cost):
+        """Wall-clock estimate for a job of this cost on this machine"""
+        with self._lock:
+            return round((cost if cost is not None else DEFAULT_COST) * self._seconds_per_cost, 1)
+
+    def backlog_seconds(self):
+        """Estimated seconds until every worker is through the queued and running jobs"""
+        now = time.time()
+        with self._lock:
+            total = 0.0
+            for job in self._jobs.values():
+                if job['status'] == JOB_QUEUED:
+                    total += self._estimate_seconds(job)
+                elif job['status'] == JOB_RUNNING:
+                    total += max(0.0, self._estimate_seconds(job) - (now - job['started_at']))
+        return total / self.max_workers
+
+    def retry_after(self):
+        """Seconds a new job should wait before submitting, or None if it is admitted now"""
+        if self.max_backlog is None:
+            return None
+        excess = self.backlog_seconds() - self.max_backlog
+        if excess <= 0:
+            return None
+        return max(1, math.ceil(excess))
+
+    def wait_idle(self, timeout=None, poll=0.5):
+        """Block until no job is queued or running; False if timeout ran out first"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.queue_depth() or self.running_count():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(poll)
+        return True
@@ -0,0 +1,114 @@
+# metadata.py - Probe each input once and keep the results in a small SQLite index
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from oldfilms_filters import probe_video, get_duration, get_video_stream, get_audio_stream, get_frame_rate
+
+logger = logging.getLogger(__name__)
+
+# Oldest entries beyond this many are dropped, so the index stays small
+MAX_ENTRIES = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT,
+    probe TEXT NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_content_hash ON probes (content_hash);
+CREATE INDEX IF NOT EXISTS probes_used_at ON probes (used_at);
+"""
+
+
+def summarize(probe):
+    """The few probe fields the UI shows, or None without probe data"""
+    if not probe:
+        return None
+    video_stream = get_video_stream(probe) or {}
+    audio_stream = get_audio_stream(probe) or {}
+    frame_rate = get_frame_rate(video_stream)
+    return {
+        'duration': get_duration(probe),
+        'width': video_stream.get('width'),
+        'height': video_stream.get('height'),
+        'frame_rate': round(frame_rate, 3) if frame_rate else None,
+        'video_codec': video_stream.get('codec_name'),
+        'audio_codec': audio_stream.get('codec_name'),
+        'format': probe.get('format', {}).get('format_name'),
+    }
+
+
+class MetadataIndex:
+    """ffprobe results kept on disk, keyed by content hash and by path
+
+    A file is recognised by its path, mtime and size without reading it, or
+    by its content hash when the caller already has one (e.g. the same clip
+    uploaded again). Only a miss on both runs ffprobe. Failed probes are not
+    stored, so a file that could not be read is tried again next time.
+    """
+
+    def __init__(self, db_path, max_entries=MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets the batch CLI and the server share one index
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=10))
+
+    def get(self, content_hash):
+        """Stored probe for a content hash, or None; never runs ffprobe"""
+        if not content_hash:
+            return None
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                'SELECT probe FROM probes WHERE content_hash = ? ORDER BY used_at DESC LIMIT 1', (content_hash,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def probe(self, path, content_hash=None):
+        """Probe data for a file, from the index when possible"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock, self._connect() as conn, conn:
+            row = conn.execute(
+                'SELECT probe FROM probes WHERE path = ? AND mtime_ns = ? AND size = ?',
+                (path, stat.st_mtime_ns, stat.st_size)
+            ).fetchone()
+            if row:
+                conn.execute('UPDATE probes SET used_at = ? WHERE path = ?', (time.time(), path))
+                return json.loads(row[0])
+
+        probe = self.get(content_hash)
+        if probe is None:
+            probe = probe_video(path)
+            if probe is None:
+                return None
+
+        with self._lock, self._connect() as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO probes (path, mtime_ns, size, content_hash, probe, used_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (path, stat.st_mtime_ns, stat.st_size, content_hash, json.dumps(probe), time.time())
+            )
+            conn.execute(
+                'DELETE FROM probes WHERE path IN '
+                '(SELECT path FROM probes ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        return probe
@@ -0,0 +1,147 @@
+# metrics.py - Job metrics in the Prometheus text exposition format
+
+import threading
+
+# Seconds; covers quick previews-sized clips up to long batch encodes
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Media seconds encoded per wall second
+SPEED_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """Monotonic total, optionally split by labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, from which Prometheus derives percentiles"""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        entry = self._values.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry['counts'][i] += 1
+        entry['sum'] += value
+        entry['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for key, entry in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, entry['counts']):
+                labels = _format_labels(self.labels + ('le',), key + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labels + ('le',), key + ('+Inf',))
+            lines.append(f'{self.name}_bucket{labels} {entry["count"]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {entry["sum"]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {entry["count"]}')
+        return lines
+
+
+class JobMetrics:
+    """Aggregates over finished jobs, rendered for a Prometheus scrape"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = Counter('oldfilms_jobs_total', 'Finished jobs by decade and result', ('decade', 'status'))
+        self.cache_hits = Counter('oldfilms_cache_hits_total', 'Submissions answered from the result cache')
+        self.rejections = Counter('oldfilms_rejected_total', 'Submissions turned away with 429 while the backlog was full')
+        self.bytes_in = Counter('oldfilms_input_bytes_total', 'Bytes of input read by finished jobs')
+        self.bytes_out = Counter('oldfilms_output_bytes_total', 'Bytes of output written by finished jobs')
+        self.media_seconds = Counter('oldfilms_media_seconds_total', 'Seconds of video encoded by finished jobs')
+        self.queue_wait = Histogram('oldfilms_job_queue_wait_seconds', 'Time from submission to start')
+        self.run_time = Histogram('oldfilms_job_run_seconds', 'Time from start to finish', ('decade',))
+        self.speed = Histogram('oldfilms_job_speed_ratio', 'Media seconds per wall second', ('decade',),
+                               buckets=SPEED_BUCKETS)
+        self.cpu_time = Counter('oldfilms_ffmpeg_cpu_seconds_total', 'ffmpeg CPU time of profiled jobs')
+        self.stage_time = Histogram('oldfilms_stage_seconds', 'Profiled stage time on the sample window',
+                                    ('decade', 'stage'))
+        self.filter_time = Counter('oldfilms_filter_seconds_total', 'Profiled time per filter on the sample window',
+                                   ('decade', 'filter'))
+        self._gauges = []
+
+    def add_gauge(self, name, help_text, func):
+        """Report func() under name at every scrape"""
+        self._gauges.append((name, help_text, func))
+
+    def record_cache_hit(self):
+        with self._lock:
+            self.cache_hits.inc()
+
+    def record_rejection(self):
+        with self._lock:
+            self.rejections.inc()
+
+    def observe_job(self, job):
+        """Account for a finished job record (see JobManager on_finish)"""
+        decade = job.get('decade', '')
+        progress = job.get('progress') or {}
+        with self._lock:
+            self.jobs.inc(decade=decade, status=job['status'])
+            if job.get('started_at'):
+                self.queue_wait.observe(job['started_at'] - job['created_at'])
+                if job.get('finished_at'):
+                    self.run_time.observe(job['finished_at'] - job['started_at'], decade=decade)
+            if progress.get('speed'):
+                self.speed.observe(progress['speed'], decade=decade)
+            if progress.get('out_time'):
+                self.media_seconds.inc(progress['out_time'])
+            self.bytes_in.inc(job.get('input_bytes') or 0)
+            self.bytes_out.inc(job.get('output_bytes') or 0)
+
+            benchmark = progress.get('benchmark')
+            if benchmark:
+                self.cpu_time.inc(benchmark['utime'] + benchmark['stime'])
+
+    def observe_profiling(self, decade, profiling):
+        """Account for the profiling passes of a job (see profiling.profile_chain)"""
+        with self._lock:
+            for stage in ('decode', 'filter', 'encode'):
+                self.stage_time.observe(profiling[stage], decade=decade, stage=stage)
+            for step in profiling.get('filters', []):
+                name = step['filter'].split('=', 1)[0]
+                self.filter_time.inc(step['seconds'], decade=decade, filter=name)
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        with self._lock:
+            lines = []
+            for metric in (self.jobs, self.cache_hits, self.rejections, self.bytes_in, self.bytes_out, self.media_seconds,
+                           self.queue_wait, self.run_time, self.speed, self.cpu_time,
+                           self.stage_time, self.filter_time):
+                lines.extend(metric.render())
+        for name, help_text, func in self._gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {func()}']
+        return '\n'.join(lines) + '\n'
@@ -2,252 +2,1261 @@
 
 import subprocess
 import logging
+import atexit
+import io
+import json
+import math
+import os
+import re
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import frame_engine
+from presets import PresetRegistry, PresetError, thaw
 
 logger = logging.getLogger(__name__)
 
+# Rough single-core seconds per output megapixel-frame, from profiling.py
+# runs at 540p and 720p. Job scheduling rescales them by how fast jobs
+# actually ran on this machine, so only their proportions matter
+PRESET_COST = {
+    'ultrafast': 0.01, 'superfast': 0.015, 'veryfast': 0.03, 'faster': 0.05,
+    'fast': 0.08, 'medium': 0.13, 'slow': 0.3,
+}
+FILTER_COST = {
+    'colorbalance': 0.016, 'gblur': 0.01, 'colorchannelmixer': 0.009,
+    'vignette': 0.004, 'hue': 0.0025, 'drawtext': 0.002,
+}
+DEFAULT_FILTER_COST = 0.001
+# x264 time grows with grain: a clean chain encodes ~7x faster than noise
+# alls=20 (the preset costs above), and it levels off beyond that
+GRAIN_REFERENCE = 20
+# Per source megapixel-frame decoded
+DECODE_COST = 0.001
+# Raw frame pipes plus each NumPy effect of the frame engine
+ENGINE_COST = 0.01
+ENGINE_EFFECT_COST = 0.005
+
+# Only the end of ffmpeg's log is kept for error messages
+STDERR_TAIL_LINES = 40
+
+# How long ffmpeg processes get to exit on SIGTERM before they are killed
+TERMINATE_GRACE_SECONDS = 3
+
+# Segment-parallel encoding: target segment length, and the shortest input
+# worth splitting at all
+PARALLEL_SEGMENT_SECONDS = 30
+PARALLEL_MIN_DURATION = 2 * PARALLEL_SEGMENT_SECONDS
+
+# Audio codecs the MP4 output can carry without re-encoding
+MP4_COPY_AUDIO_CODECS = {'aac', 'mp3'}
+
+# x264 speed/quality tiers; low_res_preset applies to outputs of at most
+# LOW_RES_HEIGHT lines, where a slower preset buys almost nothing. Only the
+# archive tier uses the decade's -tune: on the synthetic film noise it costs
+# about a third more encode time and half again the bitrate
+ENCODE_PROFILES = {
+    'fast': {'preset': 'veryfast', 'low_res_preset': 'superfast', 'crf': 25, 'tune': False, 'audio_bitrate': '96k'},
+    'balanced': {'preset': 'medium', 'low_res_preset': 'faster', 'crf': 23, 'tune': False, 'audio_bitrate': '128k'},
+    'archive': {'preset': 'slow', 'low_res_preset': 'slow', 'crf': 18, 'tune': True, 'audio_bitrate': '192k'},
+}
+DEFAULT_ENCODE_PROFILE = 'balanced'
+LOW_RES_HEIGHT = 360
+
+# Presets may pick their default profile and an x264 tune under "encode";
+# grain tuning keeps the heavy noise of the early decades instead of
+# smearing it into blocks
+X264_TUNES = ('film', 'grain')
+
+# Put the moov atom first so browsers can start playing before the download ends
+MP4_OUTPUT_ARGS = ['-movflags', '+faststart']
+
+# When a chain keeps at most one source frame in this many, the decoder skips
+# frames no other frame refers to (-skip_frame noref). Encoders rarely put
+# more than two of those in a row, so every output frame still has a decoded
+# frame close by, and decoding a 60 fps source for a 12-18 fps decade does
+# 40-60% less work
+SKIP_FRAME_MIN_RATIO = 3
+
+# Compiled filter strings are memoized per decade, options and geometry
+FILTER_CACHE_SIZE = 256
+
+# Longest text accepted for title cards and timestamps
+MAX_TEXT_OPTION_LENGTH = 64
+
+# Title cards are shown for the first few seconds
+TITLE_CARD_SECONDS = 3
+
+class FilterOptionError(ValueError):
+    """Custom options that do not match a decade's declared options"""
+
+# Decade presets live in presets/*.json (see presets.py); thaw_config stays
+# importable from here for callers that serialize them
+thaw_config = thaw
+
 def get_decade_filter_config():
-    """Return filter configurations for each decade with customization options"""
+    """Return filter configurations for each decade with customization options
+
+    The mapping is read-only and belongs to the presets in use right now; a
+    reload swaps in a new mapping rather than changing this one.
+    """
+    return preset_registry.current().decades
+
+def _filter_name(filter_step):
+    return filter_step.split('=', 1)[0]
+
+# Steps whose strength is measured in pixels, and the parameter holding it
+_PIXEL_SCALED_PARAMS = {'noise': 'alls', 'gblur': 'sigma'}
+
+def _rescale_step(filter_step, factor):
+    """Scale the pixel-sized parameter of a noise or gblur step by factor
+
+    Grain and blur applied before a downscale shrink along with the frame,
+    so the same step run on already downscaled frames is weakened by the
+    downscale ratio to keep the look. Other parameters are kept as they are.
+    """
+    name = _filter_name(filter_step)
+    params = filter_step.split('=', 1)[1].split(':')
+    for i, param in enumerate(params):
+        key, _, value = param.partition('=')
+        if key == _PIXEL_SCALED_PARAMS[name]:
+            if name == 'noise':
+                params[i] = f"alls={max(1, round(_preset_number(value) * factor))}"
+            else:
+                params[i] = f"sigma={_preset_number(value) * factor:g}"
+    return f"{name}=" + ':'.join(params)
+
+def order_filter_graph(filters, max_height=None, source_height=None):
+    """Run frame-rate decimation and downscaling ahead of the costly filters
+
+    fps and scale only ever reduce the work of the steps after them, so they
+    go first, with grain and blur rescaled by the downscale ratio so the
+    output matches filtering at full resolution. That needs the source
+    height; when it is unknown, or already no taller than max_height, the
+    scale stays at the end instead.
+    """
+    fps_steps = [f for f in filters if _filter_name(f) == 'fps']
+    chain = [f for f in filters if _filter_name(f) != 'fps']
+
+    if not max_height:
+        return fps_steps + chain
+
+    # -2 keeps the width even, which libx264 requires
+    scale_step = f"scale=-2:{max_height}"
+    if not source_height or source_height <= max_height:
+        return fps_steps + chain + [scale_step]
+
+    factor = max_height / source_height
+    chain = [_rescale_step(f, factor) if _filter_name(f) in _PIXEL_SCALED_PARAMS else f for f in chain]
+    return fps_steps + [scale_step] + chain
+
+def _parse_bool(key, value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ('true', 'false', '1', '0', 'on', 'off'):
+        return value.lower() in ('true', '1', 'on')
+    raise FilterOptionError(f"{key} must be true or false")
+
+def normalize_options(decade, custom_options=None):
+    """Validate custom options against the decade's declared options
+
+    Missing options take their declared defaults and unknown keys are
+    dropped, so two requests for the same look always normalize to the same
+    dict (in declaration order).
+    """
+    return _normalize(get_decade_filter_config()[decade].get('options', {}), custom_options)
+
+def _normalize(declared, custom_options):
+    custom_options = custom_options or {}
+    if not isinstance(custom_options, dict):
+        raise FilterOptionError("Custom options must be an object")
+
+    normalized = {}
+    for key, spec in declared.items():
+        value = custom_options.get(key)
+        if 'min' in spec:
+            if value is None:
+                value = spec['default']
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise FilterOptionError(f"{key} must be a number")
+            if not spec['min'] <= value <= spec['max']:
+                raise FilterOptionError(f"{key} must be between {spec['min']} and {spec['max']}")
+        elif 'enabled' in spec:
+            value = spec['enabled'] if value is None else _parse_bool(key, value)
+        elif 'options' in spec:
+            value = spec['default'] if value is None else value
+            if value not in spec['options']:
+                raise FilterOptionError(f"{key} must be one of {', '.join(spec['options'])}")
+        else:
+            value = spec['default'] if value is None else str(value)
+            value = ''.join(ch for ch in value if ch.isprintable())
+            if len(value) > MAX_TEXT_OPTION_LENGTH:
+                raise FilterOptionError(f"{key} is longer than {MAX_TEXT_OPTION_LENGTH} characters")
+        normalized[key] = value
+    return normalized
+
+@lru_cache(maxsize=None)
+def ffmpeg_has_filter(name):
+    """Whether the installed ffmpeg was built with a filter (assume yes if unknown)"""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-filters'], capture_output=True, text=True)
+    except OSError:
+        return True
+    names = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 2}
+    return not names or name in names
+
+def _num(value):
+    return f"{value:.4g}"
+
+def _preset_number(expression):
+    """Value of a numeric preset parameter such as '12', '24000/1001' or 'PI*0.3'
+
+    Terms are numbers or PI, joined by * and / from left to right, which is
+    what the presets use; anything else raises ValueError, so such a preset
+    set is rejected when it is loaded (see _check_presets).
+    """
+    tokens = re.split(r'([*/])', expression)
+    terms = [math.pi if term.strip() == 'PI' else float(term) for term in tokens[::2]]
+    value = terms[0]
+    for op, term in zip(tokens[1::2], terms[1:]):
+        value = value * term if op == '*' else value / term
+    return value
+
+def _escape_text(text):
+    """Escape text for a drawtext option inside a filtergraph"""
+    # First for the option parser, then for the filtergraph parser
+    for ch in "\\':":
+        text = text.replace(ch, '\\' + ch)
+    for ch in "\\'[],;":
+        text = text.replace(ch, '\\' + ch)
+    return text
+
+def _parse_filter(step):
+    """Split 'name=k=v:k2=v2' into a name and an ordered list of [key, value]"""
+    name, _, args = step.partition('=')
+    params = []
+    for part in args.split(':') if args else []:
+        key, sep, value = part.partition('=')
+        params.append([key, value] if sep else [None, part])
+    return {'name': name, 'params': params}
+
+def _format_filter(step):
+    if 'raw' in step:
+        return step['raw']
+    args = ':'.join(f"{key}={value}" if key is not None else value for key, value in step['params'])
+    return f"{step['name']}={args}" if args else step['name']
+
+class _FilterChain:
+    """Parsed filter steps that the option compilers edit in place"""
+
+    def __init__(self, steps):
+        self.steps = [_parse_filter(step) for step in steps]
+
+    def find(self, name):
+        for step in self.steps:
+            if step['name'] == name:
+                return step
+        return None
+
+    def get(self, name, key, default=None):
+        step = self.find(name)
+        for param_key, value in (step or {}).get('params', []):
+            if param_key == key:
+                return value
+        return default
+
+    def set(self, name, key, value):
+        """Set a parameter on the first step called name, if the chain has one"""
+        step = self.find(name)
+        if step is None or 'raw' in step:
+            return
+        for param in step['params']:
+            if param[0] == key:
+                param[1] = value
+                return
+        step['params'].append([key, value])
+
+    def replace(self, name, step):
+        for i, existing in enumerate(self.steps):
+            if existing['name'] == name:
+                self.steps[i] = _parse_filter(step)
+
+    def remove(self, name):
+        self.steps = [step for step in self.steps if step['name'] != name]
+
+    def append(self, step, raw=False):
+        """Add a step at the end; raw steps are kept verbatim (quoted text etc.)"""
+        if raw:
+            self.steps.append({'name': step.split('=', 1)[0], 'raw': step})
+        else:
+            self.steps.append(_parse_filter(step))
+
+    def to_list(self):
+        return [_format_filter(step) for step in self.steps]
+
+def _set_grain(chain, value, options, spec):
+    chain.set('noise', 'alls', str(round(value)))
+
+def _set_contrast(chain, value, options, spec):
+    chain.set('eq', 'contrast', _num(value))
+
+def _set_shadow_depth(chain, value, options, spec):
+    chain.set('eq', 'brightness', _num(value))
+
+def _set_saturation(chain, value, options, spec):
+    chain.set('hue', 's', _num(value))
+
+def _set_hue_shift(chain, value, options, spec):
+    chain.set('hue', 'h', _num(value))
+
+def _set_soft_focus(chain, value, options, spec):
+    chain.set('gblur', 'sigma', _num(value))
+
+def _set_frame_rate(chain, value, options, spec):
+    chain.replace('fps', f"fps={_num(value)}")
+
+def _set_sepia(chain, value, options, spec):
+    # Blend the sepia matrix with the identity; 1.0 is the plain sepia look
+    step = chain.find('colorchannelmixer')
+    identity = (1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1)
+    sepia = [_preset_number(v) for _, v in step['params']]
+    mixed = [min(2.0, max(-2.0, i + value * (c - i))) for c, i in zip(sepia, identity)]
+    step['params'] = [[None, _num(c)] for c in mixed]
+
+def _set_vignette_strength(chain, value, options, spec):
+    # The default strength is the preset's own angle; stronger values open it
+    # up towards PI/2 (the widest ffmpeg allows), weaker ones narrow it
+    angle = min(math.pi / 2, _preset_number(chain.get('vignette', 'angle', 'PI/5')))
+    default = spec['default']
+    if value <= default:
+        angle *= value / default
+    else:
+        angle += (math.pi / 2 - angle) * (value - default) / (spec['max'] - default)
+    chain.set('vignette', 'angle', _num(angle))
+
+def _set_vignette_style(chain, value, options, spec):
+    if value == 'none':
+        chain.remove('vignette')
+    elif value == 'art_deco':
+        chain.set('vignette', 'angle', 'PI/2.5')
+
+def _add_flicker(chain, value, options, spec):
+    if value:
+        # eq re-evaluates the expression per frame, so brightness jitters
+        brightness = chain.get('eq', 'brightness', '0')
+        chain.set('eq', 'brightness', f"{brightness}+0.04*(random(0)-0.5)")
+        chain.set('eq', 'eval', 'frame')
+
+def _can_draw_text():
+    # drawtext needs an ffmpeg built with libfreetype
+    if ffmpeg_has_filter('drawtext'):
+        return True
+    logger.warning("ffmpeg has no drawtext filter, skipping text overlays")
+    return False
+
+def _add_title_card(chain, value, options, spec):
+    if value and _can_draw_text():
+        text = _escape_text(options.get('title_card_text', ''))
+        enable = f"enable='lt(t,{TITLE_CARD_SECONDS})'"
+        chain.append(f"drawbox=c=black:t=fill:{enable}", raw=True)
+        chain.append(
+            f"drawtext=text={text}:expansion=none:fontcolor=white:fontsize=h/10:"
+            f"x=(w-text_w)/2:y=(h-text_h)/2:{enable}",
+            raw=True
+        )
+
+def _add_timestamp(chain, value, options, spec):
+    if value and _can_draw_text():
+        text = _escape_text(options.get('timestamp_text', ''))
+        chain.append(
+            f"drawtext=text={text}:expansion=none:fontcolor=white:fontsize=h/16:"
+            f"shadowcolor=black:shadowx=2:shadowy=2:x=w-text_w-w/20:y=h-text_h-h/15",
+            raw=True
+        )
+
+def _add_scanlines(chain, value, options, spec):
+    if value:
+        chain.append('drawgrid=w=iw:h=3:t=1:c=black@0.35')
+
+def _add_glow(chain, value, options, spec):
+    if value:
+        # A negative unsharp amount blurs, giving a soft highlight glow
+        chain.append('unsharp=lx=7:ly=7:la=-0.6')
+
+def _add_golden_tint(chain, value, options, spec):
+    if value:
+        chain.append('colorbalance=rm=0.08:gm=0.03:bm=-0.08')
+
+def _add_golden_glow(chain, value, options, spec):
+    _add_glow(chain, value, options, spec)
+    _add_golden_tint(chain, value, options, spec)
+
+def _set_vibrant_reds(chain, value, options, spec):
+    if not value:
+        chain.set('colorbalance', 'rs', '0')
+
+def _add_haze(chain, value, options, spec):
+    if value:
+        chain.append("curves=all='0/0.12 1/0.9'", raw=True)
+        chain.append('gblur=sigma=0.8')
+
+def _add_psychedelic_boost(chain, value, options, spec):
+    if value:
+        chain.set('hue', 's', _num(_preset_number(chain.get('hue', 's', '1')) * 1.35))
+
+def _add_fade(chain, value, options, spec):
+    if value:
+        chain.append("curves=all='0/0.1 1/0.93'", raw=True)
+
+# Declared options that ffmpeg filters can express; the others are accepted
+# but have no effect on the filter chain. A preset's filters are its look at
+# the declared defaults, so a compiler only runs for a value the job changed
+_OPTION_COMPILERS = {
+    'grain_intensity': _set_grain,
+    'grain_level': _set_grain,
+    'film_quality': _set_grain,
+    'film_grain': _set_grain,
+    'film_texture': _set_grain,
+    'super8_grain': _set_grain,
+    'static_level': _set_grain,
+    'digital_noise': _set_grain,
+    'contrast_level': _set_contrast,
+    'contrast_boost': _set_contrast,
+    'dramatic_lighting': _set_contrast,
+    'noir_contrast': _set_contrast,
+    'shadow_depth': _set_shadow_depth,
+    'technicolor_saturation': _set_saturation,
+    'kodachrome_look': _set_saturation,
+    'home_movie_feel': _set_saturation,
+    'color_bleeding': _set_saturation,
+    'camcorder_saturation': _set_saturation,
+    'color_shift': _set_hue_shift,
+    'warm_tone': _set_hue_shift,
+    'warm_vintage': _set_hue_shift,
+    'soft_focus': _set_soft_focus,
+    'frame_rate': _set_frame_rate,
+    'sepia_intensity': _set_sepia,
+    'vignette_strength': _set_vignette_strength,
+    'vignette_style': _set_vignette_style,
+    'flicker_enabled': _add_flicker,
+    'title_card_enabled': _add_title_card,
+    'timestamp_enabled': _add_timestamp,
+    'scanlines_enabled': _add_scanlines,
+    'glamour_glow': _add_glow,
+    'golden_tone': _add_golden_tint,
+    'golden_glow': _add_golden_glow,
+    'vibrant_reds': _set_vibrant_reds,
+    'cigarette_haze': _add_haze,
+    'psychedelic_boost': _add_psychedelic_boost,
+    'fade_edges': _add_fade,
+}
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _compile_filter_steps(snapshot, decade, options, source_height, output_height):
+    # Keyed by the preset snapshot too, so a reload never serves stale chains
+    config = snapshot.decades[decade]
+    chain = _FilterChain(config['filters'])
+    values = dict(options)
+    declared = config.get('options', {})
+    defaults = _normalize(declared, {})
+    for key, value in options:
+        compiler = _OPTION_COMPILERS.get(key)
+        if compiler and value != defaults[key]:
+            compiler(chain, value, values, declared[key])
+
+    filters = order_filter_graph(
+        chain.to_list(),
+        max_height=output_height,
+        source_height=source_height
+    )
+    return tuple(filters)
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _compile_filter_command(snapshot, decade, options, source_height, output_height):
+    return ','.join(_compile_filter_steps(snapshot, decade, options, source_height, output_height))
+
+def _compile_args(decade, custom_options, source_height, max_height):
+    snapshot = preset_registry.current()
+    config = snapshot.decades[decade]
+    options = _normalize(config.get('options', {}), custom_options)
+
+    output_height = config.get('max_height')
+    if max_height and (not output_height or max_height < output_height):
+        output_height = max_height
+    return snapshot, decade, tuple(options.items()), source_height, output_height
+
+# Source the preset check compiles for, large enough that every chain scales down
+CHECK_SOURCE = {'width': 3840, 'height': 2160}
+
+def _check_presets(snapshot):
+    """Compile every decade of a freshly loaded preset set; raises PresetError
+
+    Chains are built with the default options, with every flag flipped and
+    with every numeric option at its min and at its max, which also leaves
+    them compiled in the cache for the first requests. Each is compiled for
+    an unknown and for a 4K source, so the grain rescale and the fps and
+    scale steps are parsed too and a value this code cannot read fails here
+    rather than inside a request.
+    """
+    for decade, config in snapshot.decades.items():
+        encode = config.get('encode', {})
+        if encode.get('profile', DEFAULT_ENCODE_PROFILE) not in ENCODE_PROFILES:
+            raise PresetError(f"{decade}: unknown encode profile {encode['profile']}")
+        if encode.get('tune') not in (None,) + X264_TUNES:
+            raise PresetError(f"{decade}: unknown x264 tune {encode['tune']}")
+        declared = config.get('options', {})
+        flipped = {key: not spec['enabled'] for key, spec in declared.items() if 'enabled' in spec}
+        extremes = [{key: spec[bound] for key, spec in declared.items() if 'min' in spec} for bound in ('min', 'max')]
+        try:
+            for custom_options in [{}, flipped] + extremes:
+                options = _normalize(declared, custom_options)
+                for source_height in (None, CHECK_SOURCE['height']):
+                    steps = _compile_filter_steps(
+                        snapshot, decade, tuple(options.items()), source_height, config.get('max_height')
+                    )
+                    _frame_geometry(steps, CHECK_SOURCE)
+        except Exception as e:
+            raise PresetError(f"{decade}: filters do not compile with its options: {e}")
+
+# The registry is loaded on first use and only swaps in sets that compile
+preset_registry = PresetRegistry(check=_check_presets)
+
+def build_filter_command(decade, custom_options=None, source_height=None, max_height=None):
+    """Build FFmpeg filter command for specific decade with customizations
+
+    Raises FilterOptionError for options outside the declared ranges.
+    max_height caps the decade's own output height, e.g. for previews.
+    """
+    return _compile_filter_command(*_compile_args(decade, custom_options, source_height, max_height))
+
+def build_filter_steps(decade, custom_options=None, source_height=None, max_height=None):
+    """The steps of build_filter_command as a tuple, in the order they run"""
+    return _compile_filter_steps(*_compile_args(decade, custom_options, source_height, max_height))
+
+def get_encode_profile(decade, profile=None):
+    """Name of the encode profile to use, falling back to the decade default"""
+    if not profile:
+        return get_decade_filter_config().get(decade, {}).get('encode', {}).get('profile', DEFAULT_ENCODE_PROFILE)
+    if profile not in ENCODE_PROFILES:
+        raise FilterOptionError(f"Unknown encode profile: {profile}")
+    return profile
+
+def get_encoder_settings(decade, profile=None):
+    """Encoder settings used for a decade's output under an encode profile"""
+    profile = get_encode_profile(decade, profile)
+    tiers = ENCODE_PROFILES[profile]
+    config = get_decade_filter_config().get(decade, {})
+    tuning = config.get('encode', {})
+    max_height = config.get('max_height')
+    low_res = max_height is not None and max_height <= LOW_RES_HEIGHT
     return {
-        '1900s': {
-            'name': '1900s - Early Cinema',
-            'description': 'Hand-cranked cameras, sepia tone, heavy scratches',
-            'fps': 12,
-            'max_height': 240,  # Changed from resolution to max_height
-            'filters': [
-                'colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131',  # Sepia
-                # 'noise=alls=50:allf=t',  # Heavy noise
-                # 'eq=brightness=0.2:contrast=1.4:gamma=1.3',
-                # 'vignette=angle=PI/2:x=0.5:y=0.5',
-                'noise=alls=20:allf=t',  # Reduced noise to prevent issues
-                'eq=brightness=0.1:contrast=1.3:gamma=1.2',  # Adjusted parameters
-                'vignette=angle=3.14/2',
-                'fps=12'
-
-            ],
-            'customizable': True,
-            'options': {
-                'sepia_intensity': {'min': 0.5, 'max': 1.5, 'default': 1.0, 'label': 'Sepia Intensity'},
-                'scratches_level': {'min': 30, 'max': 70, 'default': 50, 'label': 'Film Scratches'},
-                'vignette_strength': {'min': 0.3, 'max': 1.0, 'default': 0.7, 'label': 'Vignette Effect'},
-                'flicker_enabled': {'enabled': True, 'label': 'Film Flicker Effect'},
-                'frame_rate': {'min': 8, 'max': 18, 'default': 12, 'label': 'Playback Speed (fps)'}
-            }
-        },
-        '1910s': {
-            'name': '1910s - Silent Films',
-            'description': 'Charlie Chaplin era, flickering, title cards',
-            'fps': 16,
-            'max_height': 360,
-            'filters': [
-                'colorchannelmixer=.3:.6:.1:0:.3:.6:.1:0:.3:.6:.1',  # Monochrome
-                'noise=alls=40:allf=t',
-                'eq=brightness=0.15:contrast=1.35:gamma=1.25',
-                'fps=16'
-            ],
-            'customizable': True,
-            'options': {
-                'contrast_level': {'min': 1.0, 'max': 2.0, 'default': 1.35, 'label': 'Film Contrast'},
-                'grain_intensity': {'min': 20, 'max': 60, 'default': 40, 'label': 'Film Grain'},
-                'flicker_enabled': {'enabled': True, 'label': 'Silent Film Flicker'},
-                'title_card_enabled': {'enabled': False, 'label': 'Add Title Card'},
-                'title_card_text': {'default': 'SILENT FILM', 'label': 'Title Card Text'}
-            }
-        },
-        '1920s': {
-            'name': '1920s - Jazz Age Films',
-            'description': 'Art deco style, high contrast black & white',
-            'fps': 18,
-            'max_height': 480,
-            'filters': [
-                'hue=s=0',  # Remove all color
-                'noise=alls=35:allf=t',
-                'eq=brightness=0.1:contrast=1.3:gamma=1.2',
-                'vignette=angle=PI/3',
-                'fps=18'
-            ],
-            'customizable': True,
-            'options': {
-                'contrast_boost': {'min': 1.1, 'max': 1.8, 'default': 1.3, 'label': 'Art Deco Contrast'},
-                'grain_level': {'min': 15, 'max': 50, 'default': 35, 'label': 'Film Grain'},
-                'vignette_style': {'options': ['classic', 'art_deco', 'none'], 'default': 'classic', 'label': 'Vignette Style'},
-                'glamour_glow': {'enabled': False, 'label': 'Hollywood Glamour Glow'}
-            }
-        },
-        '1930s': {
-            'name': '1930s - Golden Age',
-            'description': 'Early talkies, soft focus, dramatic lighting',
-            'fps': 24,
-            'max_height': 540,
-            'filters': [
-                'hue=s=0',
-                'noise=alls=25:allf=t',
-                'eq=brightness=0.05:contrast=1.25:gamma=1.15',
-                'gblur=sigma=0.5',  # Slight blur for dream-like quality
-                'fps=24'
-            ],
-            'customizable': True,
-            'options': {
-                'soft_focus': {'min': 0.2, 'max': 1.5, 'default': 0.5, 'label': 'Soft Focus Intensity'},
-                'dramatic_lighting': {'min': 0.8, 'max': 1.5, 'default': 1.25, 'label': 'Dramatic Contrast'},
-                'film_quality': {'min': 10, 'max': 40, 'default': 25, 'label': 'Film Grain'},
-                'golden_tone': {'enabled': False, 'label': 'Subtle Golden Tint'}
-            }
-        },
-        '1940s': {
-            'name': '1940s - War Era',
-            'description': 'Film noir style, high contrast, dramatic shadows',
-            'fps': 24,
-            'max_height': 540,
-            'filters': [
-                'hue=s=0',
-                'noise=alls=20:allf=t',
-                'eq=brightness=0.0:contrast=1.4:gamma=1.1',
-                'fps=24'
-            ],
-            'customizable': True,
-            'options': {
-                'noir_contrast': {'min': 1.2, 'max': 2.0, 'default': 1.4, 'label': 'Film Noir Contrast'},
-                'shadow_depth': {'min': -0.3, 'max': 0.1, 'default': 0.0, 'label': 'Shadow Intensity'},
-                'film_grain': {'min': 10, 'max': 35, 'default': 20, 'label': 'Wartime Film Quality'},
-                'cigarette_haze': {'enabled': False, 'label': 'Atmospheric Haze Effect'}
-            }
-        },
-        '1950s': {
-            'name': '1950s - Technicolor Era',
-            'description': 'Early color films, saturated colors, film grain',
-            'fps': 24,
-            'max_height': 540,
-            'filters': [
-                'colorbalance=rs=0.1:gs=-0.05:bs=-0.1',  # Fixed: Better color grading
-                'hue=s=1.3:h=5',  # Boosted saturation
-                'noise=alls=18:allf=t',
-                'eq=brightness=0.08:contrast=1.2',
-                'fps=24'
-            ],
-            'customizable': True,
-            'options': {
-                'technicolor_saturation': {'min': 1.0, 'max': 2.0, 'default': 1.3, 'label': 'Technicolor Saturation'},
-                'color_shift': {'min': -10, 'max': 15, 'default': 5, 'label': 'Color Temperature Shift'},
-                'film_grain': {'min': 8, 'max': 30, 'default': 18, 'label': 'Color Film Grain'},
-                'vibrant_reds': {'enabled': True, 'label': 'Enhanced Red Channel'},
-                'golden_glow': {'enabled': False, 'label': 'Hollywood Golden Glow'}
-            }
-        },
-        '1960s': {
-            'name': '1960s - Kodachrome',
-            'description': 'Vibrant colors, slight oversaturation, film texture',
-            'fps': 24,
-            'max_height': 720,
-            'filters': [
-                'colorbalance=rs=0.1:gs=0.05:bs=-0.05',  # Fixed: Gentle warm tone instead of curves
-                'hue=s=1.2:h=-3',
-                'noise=alls=15:allf=t',
-                'eq=brightness=0.05:contrast=1.15',
-                'fps=24'
-            ],
-            'customizable': True,
-            'options': {
-                'kodachrome_look': {'min': 1.0, 'max': 1.8, 'default': 1.2, 'label': 'Kodachrome Saturation'},
-                'warm_tone': {'min': -8, 'max': 5, 'default': -3, 'label': 'Warm Color Cast'},
-                'film_texture': {'min': 5, 'max': 25, 'default': 15, 'label': 'Film Texture'},
-                'psychedelic_boost': {'enabled': False, 'label': 'Psychedelic Color Boost'},
-                'fade_edges': {'enabled': False, 'label': 'Vintage Photo Fade'}
-            }
-        },
-        '1970s': {
-            'name': '1970s - Super 8 / 16mm',
-            'description': 'Home movies, warm tones, heavy grain',
-            'fps': 18,
-            'max_height': 720,
-            'filters': [
-                'colorbalance=rs=0.05:gs=0.1:bs=-0.2',  # Fixed: Warm tone using colorbalance
-                'hue=s=0.9:h=-8',
-                'noise=alls=22:allf=t',
-                'vignette=angle=PI/4',
-                'eq=brightness=0.06:contrast=1.12',
-                'fps=18'
-            ],
-            'customizable': True,
-            'options': {
-                'super8_grain': {'min': 10, 'max': 40, 'default': 22, 'label': 'Super 8 Grain'},
-                'warm_vintage': {'min': -15, 'max': 0, 'default': -8, 'label': 'Warm Vintage Tone'},
-                'home_movie_feel': {'min': 0.7, 'max': 1.2, 'default': 0.9, 'label': 'Home Movie Saturation'},
-                'light_leaks': {'enabled': False, 'label': 'Light Leak Effects'},
-                'handheld_shake': {'enabled': False, 'label': 'Handheld Camera Shake'}
-            }
-        },
-        '1980s': {
-            'name': '1980s - VHS Era',
-            'description': 'VHS tapes, scanlines, color bleeding, timestamps',
-            'fps': 25,
-            'max_height': 480,
-            'filters': [
-                'colorbalance=rs=0.1:gs=0.1:bs=0.1',  # Fixed: Subtle color adjustment
-                'noise=alls=12:allf=t',
-                'hue=s=1.25:h=8',
-                'eq=brightness=0.03:contrast=1.08',
-                'fps=25'
-            ],
-            'customizable': True,
-            'options': {
-                'static_level': {'min': 5, 'max': 25, 'default': 12, 'label': 'VHS Static'},
-                'color_bleeding': {'min': 1.0, 'max': 1.8, 'default': 1.25, 'label': 'Color Bleeding'},
-                'timestamp_enabled': {'enabled': True, 'label': 'VHS Timestamp'},
-                'timestamp_text': {'default': '12/25/85 14:30', 'label': 'Custom Timestamp'},
-                'scanlines_enabled': {'enabled': True, 'label': 'VHS Scanlines'},
-                'tracking_issues': {'enabled': False, 'label': 'Tracking Problems'}
-            }
-        },
-        '1990s': {
-            'name': '1990s - Camcorder',
-            'description': 'Digital camcorders, auto-focus hunting, date stamps',
-            'fps': 30,
-            'max_height': 480,
-            'filters': [
-                'colorbalance=rs=0.05:gs=0.05:bs=0.05',  # Fixed: Subtle digital look
-                'noise=alls=8:allf=t',
-                'hue=s=1.1:h=2',
-                'eq=brightness=0.02:contrast=1.05',
-                'fps=30'
-            ],
-            'customizable': True,
-            'options': {
-                'digital_noise': {'min': 3, 'max': 15, 'default': 8, 'label': 'Digital Artifacts'},
-                'camcorder_saturation': {'min': 0.9, 'max': 1.4, 'default': 1.1, 'label': 'Camcorder Color'},
-                'timestamp_enabled': {'enabled': True, 'label': 'Digital Date Stamp'},
-                'timestamp_text': {'default': '12/25/1995 14:30:45', 'label': 'Custom Date/Time'},
-                'auto_focus_enabled': {'enabled': True, 'label': 'Auto-focus Hunting'},
-                'zoom_artifacts': {'enabled': False, 'label': 'Digital Zoom Artifacts'}
-            }
-        }
+        'profile': profile,
+        'video_codec': 'libx264',
+        'preset': tiers['low_res_preset'] if low_res else tiers['preset'],
+        'crf': tiers['crf'],
+        'tune': tuning.get('tune') if tiers['tune'] else None,
+        # 4:2:0 keeps outputs playable in browsers; gray sources get flat chroma
+        'pix_fmt': 'yuv420p',
+        'audio_codec': 'aac',
+        'audio_bitrate': tiers['audio_bitrate'],
+    }
+
+def build_video_encoder_args(settings):
+    args = ['-c:v', settings['video_codec'], '-preset', settings['preset'], '-crf', str(settings['crf'])]
+    if settings.get('tune'):
+        args += ['-tune', settings['tune']]
+    if settings.get('pix_fmt'):
+        args += ['-pix_fmt', settings['pix_fmt']]
+    return args
+
+def build_audio_encoder_args(settings):
+    return ['-c:a', settings['audio_codec'], '-b:a', settings['audio_bitrate']]
+
+def build_encoder_args(settings):
+    """Turn encoder settings into ffmpeg output arguments"""
+    return build_video_encoder_args(settings) + build_audio_encoder_args(settings)
+
+def probe_video(input_path):
+    """Return ffprobe format and stream information for a file, or None"""
+    cmd = [
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_format', '-show_streams', input_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    except OSError as e:
+        logger.warning(f"ffprobe unavailable: {e}")
+        return None
+
+    if result.returncode != 0:
+        logger.warning(f"ffprobe failed for {input_path}: {result.stderr.strip()}")
+        return None
+    return json.loads(result.stdout)
+
+def probe_head(head):
+    """ffprobe stream information from the first bytes of a file, or None
+
+    For a stream whose header comes first (MKV, WebM, faststart MP4) this
+    has the video size and frame rate before the rest of it arrives.
+    """
+    cmd = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', '-i', 'pipe:0']
+    try:
+        result = subprocess.run(cmd, input=head, capture_output=True)
+    except OSError as e:
+        logger.warning(f"ffprobe unavailable: {e}")
+        return None
+    if result.returncode != 0:
+        return None
+    try:
+        probe = json.loads(result.stdout)
+    except ValueError:
+        return None
+    return probe if get_video_stream(probe) else None
+
+def get_duration(probe):
+    """Duration in seconds from probe data, or None when unknown"""
+    try:
+        return float(probe['format']['duration'])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+def get_frame_rate(video_stream):
+    """Average frame rate of a probed video stream, or None when unknown"""
+    num, _, den = ((video_stream or {}).get('avg_frame_rate') or '').partition('/')
+    try:
+        rate = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate or None
+
+def get_video_stream(probe):
+    """First video stream from probe data, or None"""
+    for stream in (probe or {}).get('streams', []):
+        if stream.get('codec_type') == 'video':
+            return stream
+    return None
+
+def get_audio_stream(probe):
+    """First audio stream from probe data, or None"""
+    for stream in (probe or {}).get('streams', []):
+        if stream.get('codec_type') == 'audio':
+            return stream
+    return None
+
+def plan_streams(probe):
+    """Decide how the source's streams are carried into the MP4 output
+
+    Video always goes through the filter chain. Audio is copied when MP4 can
+    hold it as is, re-encoded otherwise, and dropped for silent sources.
+    Without probe data (e.g. a piped upload) any audio is re-encoded.
+    """
+    plan = {
+        'container': 'mp4',
+        'source_format': None,
+        'video': 'encode',
+        'audio': 'encode',
+        'audio_codec': None,
     }
+    if probe is None:
+        return plan
+
+    plan['source_format'] = probe.get('format', {}).get('format_name')
+    audio_stream = get_audio_stream(probe)
+    if audio_stream is None:
+        plan['audio'] = 'none'
+    else:
+        plan['audio_codec'] = audio_stream.get('codec_name')
+        if plan['audio_codec'] in MP4_COPY_AUDIO_CODECS:
+            plan['audio'] = 'copy'
+    return plan
 
-def build_filter_command(decade, custom_options=None):
-    """Build FFmpeg filter command for specific decade with customizations"""
-    config = get_decade_filter_config()[decade]
-    filters = config['filters'].copy()
-    
-    
-    # Add aspect-ratio preserving scaling
-    if 'max_height' in config:
-        max_height = config['max_height']
-        filters.append(f"scale=-1:{max_height}")
-    
-    return ','.join(filters)
-
-def process_video_with_ffmpeg(input_path, output_path, decade, custom_options=None):
+def build_stream_args(plan, settings, video_map='0:v:0', audio_input=0):
+    """Stream mapping and audio arguments for a stream plan"""
+    args = ['-map', video_map]
+    if plan['audio'] == 'none':
+        return args + ['-an']
+    args += ['-map', f'{audio_input}:a:0?']
+    if plan['audio'] == 'copy':
+        return args + ['-c:a', 'copy']
+    return args + build_audio_encoder_args(settings)
+
+def _parse_speed(value):
+    """ffmpeg reports speed as e.g. '1.52x' or 'N/A'"""
     try:
-        filter_string = build_filter_command(decade, custom_options)
-        cmd = [
-            'ffmpeg', '-i', input_path, '-vf', filter_string,
-            '-c:v', 'libx264', '-preset', 'medium', '-crf', '23',
-            '-c:a', 'aac', '-b:a', '128k', '-y', output_path
-        ]
+        return float(value.rstrip('x'))
+    except (AttributeError, ValueError):
+        return None
+
+def _progress_report(fields, duration, started):
+    """Turn one block of -progress key=value pairs into a progress dict"""
+    elapsed = time.time() - started
+    try:
+        out_time = int(fields.get('out_time_us', 0)) / 1000000
+    except ValueError:
+        out_time = 0.0
+    try:
+        frame = int(fields.get('frame', 0))
+    except ValueError:
+        frame = 0
+
+    report = {
+        'frame': frame,
+        'out_time': round(out_time, 2),
+        'elapsed': round(elapsed, 2),
+        # Throughput measured from wall time, so it covers the whole run
+        'fps': round(frame / elapsed, 2) if elapsed > 0 else None,
+        'speed': _parse_speed(fields.get('speed')),
+        'percent': None,
+        'eta': None,
+    }
+    if duration:
+        percent = min(100.0, max(0.0, out_time / duration * 100))
+        report['percent'] = round(percent, 1)
+        if out_time > 0:
+            report['eta'] = round(elapsed * (duration - out_time) / out_time, 1)
+    if fields.get('progress') == 'end':
+        report['percent'] = 100.0
+        report['eta'] = 0
+    return report
+
+_BENCH_TIMES = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s')
+_BENCH_MAXRSS = re.compile(r'bench: maxrss=(\d+)(\w*)')
+
+def parse_benchmark(lines):
+    """Times (seconds) and peak memory from ffmpeg -benchmark output, or None"""
+    result = {}
+    for line in lines:
+        match = _BENCH_TIMES.search(line)
+        if match:
+            result['utime'], result['stime'], result['rtime'] = (float(v) for v in match.groups())
+        match = _BENCH_MAXRSS.search(line)
+        if match:
+            # Reported in KiB; 7.x prints the unit, older versions only the number
+            result['maxrss_kb'] = int(match.group(1))
+    return result or None
+
+def _drain_stderr(stream, tail):
+    for line in stream:
+        tail.append(line.rstrip())
+
+def _feed_stdin(stream, chunks):
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+    except OSError as e:
+        # ffmpeg exited early; its own error is reported from stderr
+        logger.warning(f"Stopped feeding ffmpeg: {e}")
+    finally:
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+# ffmpeg processes run in their own process groups (see run_ffmpeg), so they
+# outlive this process unless they are stopped explicitly
+_processes = set()
+_processes_lock = threading.Lock()
+
+def _start_ffmpeg(cmd, **kwargs):
+    proc = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+    with _processes_lock:
+        _processes.add(proc)
+    return proc
+
+def _finished_ffmpeg(proc):
+    with _processes_lock:
+        _processes.discard(proc)
+
+def _signal_group(proc, sig):
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(proc.pid, sig)
+        else:
+            proc.terminate()
+    except OSError:
+        pass
+
+def terminate_encodes(grace=TERMINATE_GRACE_SECONDS):
+    """Stop every ffmpeg process started here that is still running; returns how many"""
+    with _processes_lock:
+        running = [proc for proc in _processes if proc.poll() is None]
+    for proc in running:
+        _signal_group(proc, signal.SIGTERM)
+    deadline = time.time() + grace
+    for proc in running:
+        try:
+            proc.wait(max(0.0, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            # ffmpeg flushes its encoders on SIGTERM, which can take a while
+            _signal_group(proc, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    if running:
+        logger.warning(f"Stopped {len(running)} unfinished ffmpeg processes")
+    return len(running)
+
+# Whatever way the process exits, it does not leave encodes behind
+atexit.register(terminate_encodes)
+
+def run_ffmpeg(cmd, duration=None, progress_callback=None, stdin_source=None):
+    """Run an ffmpeg command, reporting parsed -progress output as it arrives
+
+    stdin_source is an optional iterable of bytes chunks written to ffmpeg's
+    stdin, for commands that read their input from pipe:0.
+    """
+    cmd = [cmd[0], '-nostats', '-progress', 'pipe:1'] + cmd[1:]
+    # In a new session, Ctrl+C or a service stop that signals the whole
+    # process group leaves encodes to finish while the server drains (no
+    # effect on Windows); terminate_encodes stops them on exit
+    proc = _start_ffmpeg(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        stdin=subprocess.PIPE if stdin_source is not None else subprocess.DEVNULL
+    )
+    stdout = io.TextIOWrapper(proc.stdout, encoding='utf-8', errors='replace')
+    stderr = io.TextIOWrapper(proc.stderr, encoding='utf-8', errors='replace')
+
+    # stderr is drained on its own thread so a chatty encode cannot block on
+    # a full pipe, and only the tail is kept in memory
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    drain = threading.Thread(target=_drain_stderr, args=(stderr, stderr_tail), daemon=True)
+    drain.start()
+
+    feeder = None
+    if stdin_source is not None:
+        feeder = threading.Thread(target=_feed_stdin, args=(proc.stdin, stdin_source), daemon=True)
+        feeder.start()
+
+    started = time.time()
+    fields = {}
+    report = None
+    for line in stdout:
+        key, _, value = line.strip().partition('=')
+        # Keep the last known value when ffmpeg has nothing new to say
+        if value != 'N/A':
+            fields[key] = value
+        if key == 'progress':
+            report = _progress_report(fields, duration, started)
+            if progress_callback:
+                progress_callback(report)
+
+    proc.wait()
+    _finished_ffmpeg(proc)
+    drain.join()
+    if feeder:
+        feeder.join()
+    if proc.returncode != 0:
+        return False, '\n'.join(stderr_tail)
+    # -benchmark figures only appear once ffmpeg exits, so send one more report
+    benchmark = parse_benchmark(stderr_tail)
+    if report is not None and benchmark:
+        report['benchmark'] = benchmark
+        if progress_callback:
+            progress_callback(report)
+    return True, report
+
+def _fps_value(params):
+    """Rate of an fps step's parameters, e.g. '12', '24000/1001' or 'fps=25:round=near'"""
+    return _preset_number(params.split(':', 1)[0].rpartition('=')[2])
+
+def chain_frame_rate(steps):
+    """Output frame rate set by a chain's fps step, or None when it keeps the source rate"""
+    for step in steps:
+        name, _, value = step.partition('=')
+        if name == 'fps':
+            return _fps_value(value)
+    return None
+
+def build_decode_args(video_stream, frame_rate):
+    """Input options that skip decoding frames a chain with this output rate drops anyway"""
+    source_rate = get_frame_rate(video_stream)
+    if not source_rate or not frame_rate or source_rate < frame_rate * SKIP_FRAME_MIN_RATIO:
+        return []
+    return ['-skip_frame', 'noref']
+
+def build_process_command(input_path, output_path, decade, custom_options=None, probe=None, plan=None,
+                          encode_profile=None, threads=None):
+    """ffmpeg command that renders one decade look of input_path to output_path"""
+    settings = get_encoder_settings(decade, encode_profile)
+    video_stream = get_video_stream(probe) or {}
+    steps = build_filter_steps(decade, custom_options, source_height=video_stream.get('height'))
+    thread_args = ['-filter_threads', str(threads), '-threads', str(threads)] if threads else []
+    return (
+        ['ffmpeg'] + build_decode_args(video_stream, chain_frame_rate(steps))
+        + ['-i', input_path, '-vf', ','.join(steps)]
+        + build_video_encoder_args(settings)
+        + thread_args
+        + build_stream_args(plan or plan_streams(probe), settings)
+        + MP4_OUTPUT_ARGS
+        + ['-y', output_path]
+    )
+
+def engine_effects(decade, custom_options=None):
+    """Frame engine effects the options ask for; empty when the engine is unavailable
+
+    Only options changed from the decade's defaults count, so default jobs
+    keep streaming input, segmenting and fan-out.
+    """
+    if not frame_engine.ENABLED:
+        return []
+    return frame_engine.active_effects(normalize_options(decade, custom_options), normalize_options(decade))
+
+def _frame_geometry(steps, video_stream):
+    """Width, height and frame rate of the frames a filter chain puts out"""
+    width, height = video_stream.get('width'), video_stream.get('height')
+    fps = None
+    for step in steps:
+        name, _, value = step.partition('=')
+        if name == 'fps':
+            fps = _fps_value(value)
+        elif name == 'scale' and value.startswith('-2:'):
+            # The same rounding ffmpeg applies for -2: nearest even width
+            new_height = int(value.split(':')[1])
+            width = round(width * new_height / (height * 2)) * 2
+            height = new_height
+    return width, height, fps or get_frame_rate(video_stream) or 25.0
+
+def estimate_cost(probe, decade, custom_options=None, encode_profile=None):
+    """Rough single-core seconds to render a probed input, or None when unknown
+
+    Scales with the output frame count and size (after the chain's fps and
+    scale), the chain's filters, the encoder preset and grain strength, and
+    any frame engine effects.
+    """
+    duration = get_duration(probe)
+    video_stream = get_video_stream(probe)
+    if not duration or not video_stream or not video_stream.get('height'):
+        return None
+    steps = build_filter_steps(decade, custom_options, source_height=video_stream['height'])
+    width, height, fps = _frame_geometry(steps, video_stream)
+    output_mpf = duration * fps * width * height / 1e6
+    source_mpf = duration * (get_frame_rate(video_stream) or fps) * video_stream['width'] * video_stream['height'] / 1e6
+
+    grain = 0.0
+    for step in steps:
+        if _filter_name(step) == 'noise':
+            params = dict(param.partition('=')[::2] for param in step.split('=', 1)[1].split(':'))
+            grain = max(grain, _preset_number(params.get('alls', '0')))
+    encode = PRESET_COST.get(get_encoder_settings(decade, encode_profile)['preset'], PRESET_COST['medium'])
+    per_mpf = encode * (0.15 + 0.85 * min(grain / GRAIN_REFERENCE, 1.2))
+    per_mpf += sum(
+        FILTER_COST.get(_filter_name(step), DEFAULT_FILTER_COST)
+        for step in steps if _filter_name(step) not in ('fps', 'scale')
+    )
+    effects = engine_effects(decade, custom_options)
+    if effects:
+        per_mpf += ENGINE_COST + ENGINE_EFFECT_COST * len(effects)
+    return round(source_mpf * DECODE_COST + output_mpf * per_mpf, 2)
+
+def process_video_with_engine(input_path, output_path, decade, custom_options=None, progress_callback=None,
+                              probe=None, plan=None, encode_profile=None, threads=None):
+    """Encode input_path through the decade chain and the NumPy frame engine
+
+    One ffmpeg decodes and filters the video into raw RGB frames on a pipe,
+    the frame engine adds the effects ffmpeg filters cannot express, and a
+    second ffmpeg encodes the frames, taking the audio from input_path.
+    """
+    probe = probe or probe_video(input_path)
+    plan = plan or plan_streams(probe)
+    video_stream = get_video_stream(probe)
+    if not video_stream:
+        return False, "No video stream found"
+    settings = get_encoder_settings(decade, encode_profile)
+    options = normalize_options(decade, custom_options)
+    steps = build_filter_steps(decade, custom_options, source_height=video_stream.get('height'))
+    width, height, fps = _frame_geometry(steps, video_stream)
+    thread_args = ['-filter_threads', str(threads), '-threads', str(threads)] if threads else []
+
+    # The explicit final scale pins the frame size the engine was built for
+    decode_cmd = (
+        ['ffmpeg', '-v', 'error'] + build_decode_args(video_stream, chain_frame_rate(steps))
+        + ['-i', input_path, '-map', '0:v:0', '-vf', ','.join(steps + (f'scale={width}:{height}',))]
+        + thread_args
+        + ['-f', 'rawvideo', '-pix_fmt', frame_engine.PIXEL_FORMAT, 'pipe:1']
+    )
+    encode_cmd = (
+        ['ffmpeg', '-f', 'rawvideo', '-pix_fmt', frame_engine.PIXEL_FORMAT,
+         '-s', f'{width}x{height}', '-r', f'{fps:g}', '-i', 'pipe:0', '-i', input_path]
+        + build_video_encoder_args(settings)
+        + (['-threads', str(threads)] if threads else [])
+        + build_stream_args(plan, settings, audio_input=1)
+        + MP4_OUTPUT_ARGS
+        + ['-y', output_path]
+    )
+
+    engine = frame_engine.FrameEngine(width, height, fps, options, defaults=normalize_options(decade))
+    logger.info(f"Processing with {decade} filter and frame engine effects {', '.join(engine.effects)}")
+    decoder = _start_ffmpeg(decode_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    drain = threading.Thread(
+        target=_drain_stderr,
+        args=(io.TextIOWrapper(decoder.stderr, encoding='utf-8', errors='replace'), stderr_tail),
+        daemon=True
+    )
+    drain.start()
+    success = False
+    try:
+        success, result = run_ffmpeg(encode_cmd, get_duration(probe), progress_callback,
+                                     stdin_source=engine.frames(decoder.stdout))
+    finally:
+        # A decoder whose encoder gave up would block on the full pipe forever
+        if not success and decoder.poll() is None:
+            decoder.kill()
+        decoder.wait()
+        _finished_ffmpeg(decoder)
+        decoder.stdout.close()
+        drain.join()
+    if success and decoder.returncode != 0:
+        return False, '\n'.join(stderr_tail)
+    return success, "Success" if success else result
+
+def process_video_with_ffmpeg(input_path, output_path, decade, custom_options=None, progress_callback=None,
+                              parallel=False, input_stream=None, probe=None, plan=None, encode_profile=None,
+                              threads=None, benchmark=False):
+    """Encode input_path with a decade's look
+
+    With input_stream (an iterable of bytes chunks), ffmpeg reads the input
+    from its stdin while it arrives instead of from input_path. probe may
+    then be what probe_head read from the start of the stream: its video
+    size and frame rate still let the chain scale first and skip frames,
+    but progress has no percentage and any audio is re-encoded, since the
+    rest of the file is unknown. Otherwise probe and plan may be passed in
+    when the caller already has them. threads caps the
+    filter and encoder threads of this one ffmpeg process, or of all segment
+    encoders of a parallel encode together. With benchmark,
+    the final progress report also carries ffmpeg's CPU time and peak memory.
+    Options only the frame engine can render go through
+    process_video_with_engine instead, whole-file and unsegmented.
+    """
+    try:
+        if input_stream is not None:
+            input_path = 'pipe:0'
+            plan = plan or plan_streams(None)
+            duration = None
+        else:
+            if probe is None:
+                probe = probe_video(input_path)
+            plan = plan or plan_streams(probe)
+            duration = get_duration(probe)
+        if engine_effects(decade, custom_options):
+            if input_stream is None:
+                return process_video_with_engine(
+                    input_path, output_path, decade, custom_options, progress_callback=progress_callback,
+                    probe=probe, plan=plan, encode_profile=encode_profile, threads=threads
+                )
+            logger.warning(f"Frame engine effects need a file input; skipped for this {decade} stream")
+        if parallel and duration and duration >= PARALLEL_MIN_DURATION:
+            return process_video_parallel(
+                input_path, output_path, decade, custom_options,
+                progress_callback=progress_callback, probe=probe, plan=plan, encode_profile=encode_profile,
+                threads=threads
+            )
+        
+        cmd = build_process_command(
+            input_path, output_path, decade, custom_options,
+            probe=probe, plan=plan, encode_profile=encode_profile, threads=threads
+        )
+        if benchmark:
+            cmd.insert(1, '-benchmark')
         
         logger.info(f"Processing with {decade} filter")
         logger.info(f"Custom options: {custom_options}")
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        return result.returncode == 0, result.stderr if result.returncode != 0 else "Success"
+        success, result = run_ffmpeg(cmd, duration, progress_callback, stdin_source=input_stream)
+        return success, "Success" if success else result
+    except Exception as e:
+        return False, str(e)
+
+def build_fanout_graph(decades, custom_options=None, source_height=None):
+    """filter_complex that splits the decoded video into one chain per decade
+
+    custom_options maps decade -> options. The output of the i-th decade's
+    chain is labelled [v<i>].
+    """
+    custom_options = custom_options or {}
+    branches = ''.join(f'[s{i}]' for i in range(len(decades)))
+    graph = [f'[0:v]split={len(decades)}{branches}']
+    for i, decade in enumerate(decades):
+        chain = build_filter_command(decade, custom_options.get(decade), source_height=source_height)
+        graph.append(f'[s{i}]{chain}[v{i}]')
+    return ';'.join(graph)
+
+def process_video_multi(input_path, outputs, custom_options=None, progress_callback=None,
+                        probe=None, plan=None, encode_profile=None, threads=None):
+    """Render several decade looks from one decode of input_path
+
+    outputs maps decade -> output path and custom_options maps decade ->
+    options. A single ffmpeg decodes the source once, splits the frames into
+    one filter chain per decade and encodes all outputs side by side.
+    Decades that need the frame engine are rendered one by one afterwards.
+    """
+    try:
+        custom_options = custom_options or {}
+        probe = probe or probe_video(input_path)
+        plan = plan or plan_streams(probe)
+        engine_decades = [d for d in outputs if engine_effects(d, custom_options.get(d))]
+        decades = [d for d in outputs if d not in engine_decades]
+        for decade in engine_decades:
+            success, result = process_video_with_engine(
+                input_path, outputs[decade], decade, custom_options.get(decade),
+                progress_callback=progress_callback, probe=probe, plan=plan,
+                encode_profile=encode_profile, threads=threads
+            )
+            if not success:
+                return False, result
+        if not decades:
+            return True, "Success"
+        video_stream = get_video_stream(probe) or {}
+        graph = build_fanout_graph(decades, custom_options, source_height=video_stream.get('height'))
+
+        # The decode feeds every chain, so only skip what the fastest one drops
+        rates = [
+            chain_frame_rate(build_filter_steps(d, custom_options.get(d), source_height=video_stream.get('height')))
+            for d in decades
+        ]
+        decode_args = build_decode_args(video_stream, max(rates) if all(rates) else None)
+        cmd = ['ffmpeg'] + decode_args + ['-i', input_path, '-filter_complex', graph]
+        if threads:
+            cmd += ['-filter_threads', str(threads), '-filter_complex_threads', str(threads)]
+        for i, decade in enumerate(decades):
+            settings = get_encoder_settings(decade, encode_profile)
+            cmd += build_video_encoder_args(settings)
+            if threads:
+                cmd += ['-threads', str(threads)]
+            cmd += build_stream_args(plan, settings, video_map=f'[v{i}]') + MP4_OUTPUT_ARGS + ['-y', outputs[decade]]
+
+        logger.info(f"Processing with {', '.join(decades)} filters in one pass")
+        success, result = run_ffmpeg(cmd, get_duration(probe), progress_callback)
+        return success, "Success" if success else result
+    except Exception as e:
+        return False, str(e)
+
+def _split_keyframe_segments(input_path, work_dir, segment_seconds):
+    """Stream-copy the video track into segments cut at keyframes
+
+    Returns (path, start) pairs, start being the segment's offset in
+    seconds from the beginning of the input.
+    """
+    pattern = os.path.join(work_dir, 'segment_%04d.mkv')
+    list_path = os.path.join(work_dir, 'segments.csv')
+    cmd = [
+        'ffmpeg', '-v', 'error', '-i', input_path, '-map', '0:v:0', '-c', 'copy',
+        '-f', 'segment', '-segment_time', str(segment_seconds), '-reset_timestamps', '1',
+        '-segment_list', list_path, '-segment_list_type', 'csv',
+        '-y', pattern
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    if result.returncode != 0:
+        raise RuntimeError(f"Splitting failed: {result.stderr.strip()}")
+    segments = []
+    with open(list_path, encoding='utf-8') as f:
+        for line in f:
+            name, start, _ = line.strip().rsplit(',', 2)
+            segments.append((os.path.join(work_dir, name), float(start)))
+    return segments
+
+def _segment_filter(filter_string, start):
+    """A chain for a segment that starts start seconds into the input
+
+    Segments are cut with their timestamps reset to zero. Shifting them back
+    to their place in the input while filtering keeps time-based steps (the
+    title card's enable='lt(t,...)') where they belong, and shifting them
+    to zero again afterwards leaves the pieces as the concat step expects.
+    """
+    if not start:
+        return filter_string
+    return f"setpts=PTS+{start:.6f}/TB,{filter_string},setpts=PTS-{start:.6f}/TB"
+
+def _write_concat_list(paths, list_path):
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+def process_video_parallel(input_path, output_path, decade, custom_options=None, progress_callback=None,
+                           workers=None, segment_seconds=PARALLEL_SEGMENT_SECONDS, probe=None, plan=None,
+                           encode_profile=None, threads=None):
+    """Filter and encode keyframe-aligned segments side by side, then join them
+
+    The video track is split without re-encoding, every segment runs through
+    the decade chain in its own ffmpeg process, and the encoded pieces are
+    joined with the concat demuxer. Audio is handled once for the whole file
+    while joining, following the stream plan. threads is this job's share of
+    the cores (all of them by default), split between the segment encoders.
+    """
+    budget = threads or os.cpu_count() or 1
+    workers = workers or budget
+    probe = probe or probe_video(input_path)
+    plan = plan or plan_streams(probe)
+    duration = get_duration(probe)
+    video_stream = get_video_stream(probe) or {}
+    settings = get_encoder_settings(decade, encode_profile)
+    steps = build_filter_steps(decade, custom_options, source_height=video_stream.get('height'))
+    filter_string = ','.join(steps)
+    decode_args = build_decode_args(video_stream, chain_frame_rate(steps))
+    # Share the job's cores between the segment encoders instead of oversubscribing
+    threads_per_worker = str(max(1, budget // workers))
+
+    work_dir = tempfile.mkdtemp(prefix='oldfilms_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        segments = _split_keyframe_segments(input_path, work_dir, segment_seconds)
+        logger.info(f"Encoding {len(segments)} segments of {input_path} on {workers} workers")
+
+        segment_times = [0.0] * len(segments)
+        progress_lock = threading.Lock()
+        started = time.time()
+
+        def report_progress(index, report):
+            if not progress_callback:
+                return
+            with progress_lock:
+                segment_times[index] = report['out_time']
+                done = sum(segment_times)
+            elapsed = time.time() - started
+            progress_callback({
+                'frame': None,
+                'out_time': round(done, 2),
+                'elapsed': round(elapsed, 2),
+                'fps': None,
+                'speed': round(done / elapsed, 3) if elapsed > 0 else None,
+                'percent': round(min(100.0, done / duration * 100), 1) if duration else None,
+                'eta': round(elapsed * (duration - done) / done, 1) if duration and done > 0 else None,
+                'segments': len(segments),
+            })
+
+        def encode_segment(index):
+            segment, start = segments[index]
+            piece = os.path.join(work_dir, f'encoded_{index:04d}.mkv')
+            cmd = (
+                ['ffmpeg'] + decode_args + ['-i', segment, '-vf', _segment_filter(filter_string, start), '-an']
+                + build_video_encoder_args(settings)
+                + ['-threads', threads_per_worker, '-y', piece]
+            )
+            success, result = run_ffmpeg(cmd, progress_callback=lambda report: report_progress(index, report))
+            if not success:
+                raise RuntimeError(f"Segment {index} failed: {result}")
+            return piece
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pieces = list(pool.map(encode_segment, range(len(segments))))
+
+        list_path = os.path.join(work_dir, 'concat.txt')
+        _write_concat_list(pieces, list_path)
+        cmd = (
+            ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path, '-i', input_path]
+            + build_stream_args(plan, settings, audio_input=1)
+            + ['-c:v', 'copy'] + MP4_OUTPUT_ARGS + ['-y', output_path]
+        )
+        success, result = run_ffmpeg(cmd)
+        return success, "Success" if success else result
     except Exception as e:
         return False, str(e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,228 @@
+# presets.py - Decade presets loaded from data files, validated once and reloaded on change
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from types import MappingProxyType
+
+try:
+    import tomllib
+except ImportError:
+    # Python < 3.11: only .json presets are read
+    tomllib = None
+
+logger = logging.getLogger(__name__)
+
+PRESET_DIR = os.environ.get('OLDFILMS_PRESET_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'presets'
+)
+
+FILTER_STEP_PATTERN = re.compile(r'^[a-z][a-z0-9_]*(=.+)?$')
+DECADE_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]+$')
+
+
+class PresetError(ValueError):
+    """A preset file that is missing, unreadable or does not validate"""
+
+
+def freeze(value):
+    """Recursively turn dicts into read-only mappings and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Plain dict/list copy of a frozen preset, e.g. for JSON serialization"""
+    if isinstance(value, MappingProxyType):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _validate_option(key, spec):
+    if not isinstance(spec, dict) or not isinstance(spec.get('label'), str):
+        raise PresetError(f"option {key} needs a label")
+    if 'min' in spec:
+        if not all(_is_number(spec.get(field)) for field in ('min', 'max', 'default')):
+            raise PresetError(f"option {key} needs numeric min, max and default")
+        if not spec['min'] <= spec['default'] <= spec['max']:
+            raise PresetError(f"option {key} default is outside min..max")
+    elif 'enabled' in spec:
+        if not isinstance(spec['enabled'], bool):
+            raise PresetError(f"option {key} enabled must be true or false")
+    elif 'options' in spec:
+        if not spec['options'] or spec.get('default') not in spec['options']:
+            raise PresetError(f"option {key} default must be one of its options")
+    elif not isinstance(spec.get('default'), str):
+        raise PresetError(f"option {key} needs min/max, enabled, options or a text default")
+
+
+def validate_preset(config):
+    """Check the shape of one decade definition; raises PresetError"""
+    if not isinstance(config, dict):
+        raise PresetError("a preset must be an object")
+    for field in ('name', 'description'):
+        if not isinstance(config.get(field), str):
+            raise PresetError(f"{field} must be a string")
+    filters = config.get('filters')
+    if not isinstance(filters, list) or not filters:
+        raise PresetError("filters must be a non-empty list")
+    for step in filters:
+        if not isinstance(step, str) or not FILTER_STEP_PATTERN.match(step) or ',' in step:
+            raise PresetError(f"invalid filter step: {step!r}")
+    if config.get('fps') is not None and not (_is_number(config['fps']) and config['fps'] > 0):
+        raise PresetError("fps must be a positive number")
+    max_height = config.get('max_height')
+    if max_height is not None and not (isinstance(max_height, int) and max_height > 0):
+        raise PresetError("max_height must be a positive integer")
+    options = config.get('options', {})
+    if not isinstance(options, dict):
+        raise PresetError("options must be an object")
+    for key, spec in options.items():
+        _validate_option(key, spec)
+    if not isinstance(config.get('encode', {}), dict):
+        raise PresetError("encode must be an object")
+
+
+class PresetSnapshot:
+    """One consistent set of decades, with its JSON form and ETag precomputed"""
+
+    def __init__(self, decades, version):
+        self.decades = freeze(decades)
+        self.version = version
+        self.json = json.dumps(decades)
+        self.etag = hashlib.sha256(self.json.encode('utf-8')).hexdigest()[:32]
+
+
+class PresetRegistry:
+    """Decade presets read from a folder of .json (or .toml) files
+
+    Each file defines one decade, named after the file (1900s.json defines
+    '1900s'); decades are listed in file name order. A load validates every
+    file and passes the whole set to check (e.g. compiling each chain), and
+    only a set that passes replaces the current snapshot, in one assignment.
+    Readers therefore always see a complete, valid set, and a broken edit
+    keeps the previous presets serving until it is fixed.
+    """
+
+    def __init__(self, folder=PRESET_DIR, check=None):
+        self.folder = folder
+        self.check = check
+        self._snapshot = None
+        self._signature = None
+        self._load_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _files(self):
+        extensions = ('.json', '.toml') if tomllib else ('.json',)
+        try:
+            names = sorted(name for name in os.listdir(self.folder) if name.endswith(extensions))
+        except OSError as e:
+            raise PresetError(f"Cannot read preset folder {self.folder}: {e}")
+        return [os.path.join(self.folder, name) for name in names]
+
+    def _signature_of(self, paths):
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _read(self, path):
+        try:
+            if path.endswith('.toml'):
+                with open(path, 'rb') as f:
+                    return tomllib.load(f)
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise PresetError(f"{os.path.basename(path)}: {e}")
+
+    def _load(self, paths, version):
+        decades = {}
+        for path in paths:
+            decade = os.path.splitext(os.path.basename(path))[0]
+            if not DECADE_ID_PATTERN.match(decade):
+                raise PresetError(f"{os.path.basename(path)}: file name is not a valid decade id")
+            if decade in decades:
+                raise PresetError(f"{decade} is defined twice")
+            config = self._read(path)
+            try:
+                validate_preset(config)
+            except PresetError as e:
+                raise PresetError(f"{os.path.basename(path)}: {e}")
+            decades[decade] = config
+        if not decades:
+            raise PresetError(f"No presets found in {self.folder}")
+
+        snapshot = PresetSnapshot(decades, version)
+        if self.check:
+            self.check(snapshot)
+        return snapshot
+
+    def current(self):
+        """The snapshot in use, loading the presets on first use"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.reload()
+            snapshot = self._snapshot
+        return snapshot
+
+    def reload(self):
+        """Load the presets again if any file changed; True when a new set was swapped in
+
+        A set that fails validation is logged and ignored while an earlier
+        set is in use; without one (at startup) the PresetError is raised.
+        """
+        with self._load_lock:
+            paths = self._files()
+            signature = self._signature_of(paths)
+            if self._snapshot is not None and signature == self._signature:
+                return False
+            version = self._snapshot.version + 1 if self._snapshot else 1
+            try:
+                snapshot = self._load(paths, version)
+            except PresetError as e:
+                if self._snapshot is None:
+                    raise
+                # Do not retry the same broken files on every poll
+                self._signature = signature
+                logger.error(f"Keeping presets v{self._snapshot.version}, reload failed: {e}")
+                return False
+            self._snapshot = snapshot
+            self._signature = signature
+        logger.info(f"Loaded presets v{version}: {', '.join(snapshot.decades)}")
+        return True
+
+    def start(self, interval):
+        """Poll the folder for changes every interval seconds on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._loop, args=(interval,), name='oldfilms-presets', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.reload()
+            except PresetError as e:
+                logger.error(f"Preset reload failed: {e}")
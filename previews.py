@@ -0,0 +1,177 @@
+# previews.py - Fast low-resolution previews for tuning filter options
+
+import logging
+import math
+import os
+import re
+import subprocess
+import threading
+import uuid
+
+from oldfilms_filters import build_filter_command, get_duration, get_video_stream, probe_video
+from result_cache import hash_file
+from janitor import sharded_path
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_HEIGHT = 360
+# Proxies cover fixed windows of the source so nearby start times share one
+PROXY_WINDOW_SECONDS = 10
+MAX_CLIP_SECONDS = 5
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class PreviewError(ValueError):
+    """A preview request whose start time or duration cannot be rendered"""
+
+
+def preview_filter_command(decade, custom_options, source_height):
+    """The decade chain for a source of source_height, shrunk to preview size
+
+    Compiled for the source's real height, so grain and blur are rescaled by
+    the same ratio as in the real job and the preview looks like its output
+    scaled down to PREVIEW_HEIGHT. The proxy frames it runs on are already no
+    taller than PREVIEW_HEIGHT, so the chain's scale step does little work.
+    """
+    return build_filter_command(decade, custom_options, source_height=source_height, max_height=PREVIEW_HEIGHT)
+
+
+class PreviewRenderer:
+    """Render previews through the decade chains from cached source proxies
+
+    Each preview source is stored once under its content hash, which doubles
+    as the upload id clients send back for later previews. The first preview
+    of a window decodes the source into a small intra-only proxy; later
+    previews only decode that proxy. Proxies are built under a lock per
+    window, so only requests for the same window wait for each other.
+    """
+
+    def __init__(self, source_folder, proxy_folder):
+        self.source_folder = source_folder
+        self.proxy_folder = proxy_folder
+        self._lock = threading.Lock()
+        # (upload id, window start) -> lock held while that proxy is built
+        self._proxy_locks = {}
+        # (duration, height) probed once per source, to reject start times
+        # past its end and to scale grain as the real job does
+        self._source_info = {}
+        os.makedirs(source_folder, exist_ok=True)
+        os.makedirs(proxy_folder, exist_ok=True)
+
+    def add_source(self, temp_path, extension):
+        """Move an uploaded file into the source store and return its upload id"""
+        upload_id = hash_file(temp_path)
+        path = sharded_path(self.source_folder, f"{upload_id}.{extension}")
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, path)
+        return upload_id
+
+    def source_path(self, upload_id):
+        """Stored source for an upload id, or None if it is unknown"""
+        if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+            return None
+        shard = os.path.dirname(sharded_path(self.source_folder, upload_id))
+        for name in os.listdir(shard):
+            if name.split('.', 1)[0] == upload_id:
+                return os.path.join(shard, name)
+        return None
+
+    def source_info(self, upload_id):
+        """(duration in seconds, frame height) of a stored source; either may be None"""
+        with self._lock:
+            if upload_id in self._source_info:
+                return self._source_info[upload_id]
+        source = self.source_path(upload_id)
+        probe = probe_video(source) if source else None
+        info = (get_duration(probe), (get_video_stream(probe) or {}).get('height'))
+        with self._lock:
+            self._source_info[upload_id] = info
+        return info
+
+    def get_proxy(self, upload_id, window_start):
+        """Path of the low-resolution proxy covering one window of the source"""
+        proxy_path = sharded_path(self.proxy_folder, f"{upload_id}_{window_start}.mkv")
+        key = (upload_id, window_start)
+        with self._lock:
+            lock = self._proxy_locks.setdefault(key, threading.Lock())
+        with lock:
+            try:
+                return self._build_proxy(upload_id, window_start, proxy_path)
+            finally:
+                with self._lock:
+                    # Later requests find the proxy on disk and need no lock
+                    if self._proxy_locks.get(key) is lock:
+                        del self._proxy_locks[key]
+
+    def _build_proxy(self, upload_id, window_start, proxy_path):
+        if os.path.exists(proxy_path):
+            return proxy_path
+
+        source = self.source_path(upload_id)
+        if source is None:
+            raise FileNotFoundError(f"Unknown upload {upload_id}")
+
+        # Unique, since a request arriving after a failed build may retry alongside
+        temp_path = f"{proxy_path}.{uuid.uuid4().hex}.tmp.mkv"
+        cmd = [
+            'ffmpeg', '-v', 'error', '-ss', str(window_start), '-t', str(PROXY_WINDOW_SECONDS),
+            '-i', source, '-an', '-vf', f"scale=-2:min({PREVIEW_HEIGHT}\\,ih)",
+            # MJPEG is intra-only, so seeking inside the proxy is free
+            '-c:v', 'mjpeg', '-q:v', '3', '-y', temp_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+        if result.returncode != 0:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise RuntimeError(f"Proxy creation failed: {result.stderr.strip()}")
+        os.replace(temp_path, proxy_path)
+        logger.info(f"Created preview proxy {os.path.basename(proxy_path)}")
+        return proxy_path
+
+    def render(self, upload_id, decade, custom_options=None, start=0.0, mode='frame', duration=3.0):
+        """Render a still frame (JPEG) or a short clip (MP4), returning (bytes, mimetype)
+
+        Raises PreviewError for a start time or clip duration out of range.
+        """
+        try:
+            start, duration = float(start), float(duration)
+        except (TypeError, ValueError):
+            raise PreviewError('start and duration must be numbers of seconds')
+        if not math.isfinite(start) or start < 0:
+            raise PreviewError('start must be 0 or more seconds')
+        if mode == 'clip' and not (math.isfinite(duration) and 0 < duration <= MAX_CLIP_SECONDS):
+            raise PreviewError(f'duration must be more than 0 and at most {MAX_CLIP_SECONDS} seconds')
+        source_duration, source_height = self.source_info(upload_id)
+        if source_duration is not None and start >= source_duration:
+            raise PreviewError(f'start must be before the end of the video ({source_duration:.1f} seconds)')
+
+        window_start = int(start // PROXY_WINDOW_SECONDS) * PROXY_WINDOW_SECONDS
+        proxy = self.get_proxy(upload_id, window_start)
+        # Keep a source that is still being tuned from expiring (see janitor.py)
+        for path in (proxy, self.source_path(upload_id)):
+            if path:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+
+        filter_string = preview_filter_command(decade, custom_options, source_height)
+        cmd = ['ffmpeg', '-v', 'error', '-ss', f"{start - window_start:.3f}", '-i', proxy, '-vf', filter_string]
+        if mode == 'clip':
+            duration = max(0.5, duration)
+            cmd += [
+                '-t', str(duration), '-an', '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '28',
+                '-pix_fmt', 'yuv420p', '-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4', 'pipe:1'
+            ]
+            mimetype = 'video/mp4'
+        else:
+            cmd += ['-frames:v', '1', '-c:v', 'mjpeg', '-q:v', '3', '-f', 'image2pipe', 'pipe:1']
+            mimetype = 'image/jpeg'
+
+        result = subprocess.run(cmd, capture_output=True)
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(f"Preview failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        return result.stdout, mimetype
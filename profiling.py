@@ -0,0 +1,71 @@
+# profiling.py - Opt-in stage and per-filter timing of a decade chain
+
+import logging
+import subprocess
+
+from oldfilms_filters import (
+    build_filter_steps, get_encoder_settings, build_video_encoder_args, get_video_stream,
+    parse_benchmark, probe_video, build_decode_args, chain_frame_rate
+)
+
+logger = logging.getLogger(__name__)
+
+# Every pass reads the same window from the start of the input, so profiling
+# costs about the same for a 10 second clip and a feature film
+SAMPLE_SECONDS = 10
+
+
+def _timed_pass(input_path, sample_seconds, filters=None, encoder_args=None, decode_args=()):
+    """Wall seconds of one ffmpeg pass into the null muxer, from -benchmark"""
+    cmd = ['ffmpeg', '-benchmark', '-nostats', '-t', str(sample_seconds), *decode_args,
+           '-i', input_path, '-map', '0:v:0']
+    if filters:
+        cmd += ['-vf', ','.join(filters)]
+    cmd += encoder_args or ['-c:v', 'rawvideo']
+    cmd += ['-f', 'null', '-']
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    benchmark = parse_benchmark(result.stderr.splitlines()[-20:])
+    if result.returncode != 0 or not benchmark:
+        raise RuntimeError(f"Profiling pass failed: {result.stderr.strip()[-500:]}")
+    return benchmark['rtime']
+
+
+def profile_chain(input_path, decade, custom_options=None, probe=None, encode_profile=None,
+                  sample_seconds=SAMPLE_SECONDS, per_filter=True):
+    """Split the cost of one decade look into decode, filter and encode time
+
+    The passes are decode only, decode plus the whole chain, and decode plus
+    chain plus x264, all into the null muxer; each stage is the difference
+    to the previous pass. With per_filter, every prefix of the chain is timed
+    too, so a step's cost is how much it adds to the prefix before it.
+    Times are wall seconds for the first sample_seconds of the input.
+    """
+    probe = probe or probe_video(input_path)
+    video_stream = get_video_stream(probe) or {}
+    steps = build_filter_steps(decade, custom_options, source_height=video_stream.get('height'))
+    encoder_args = build_video_encoder_args(get_encoder_settings(decade, encode_profile))
+    # Decode the way the job does, including frames it skips
+    decode_args = build_decode_args(video_stream, chain_frame_rate(steps))
+
+    decode = _timed_pass(input_path, sample_seconds, decode_args=decode_args)
+    filtered = _timed_pass(input_path, sample_seconds, steps, decode_args=decode_args)
+    encoded = _timed_pass(input_path, sample_seconds, steps, encoder_args, decode_args)
+    result = {
+        'sample_seconds': sample_seconds,
+        'decode': round(decode, 3),
+        'filter': round(max(0.0, filtered - decode), 3),
+        'encode': round(max(0.0, encoded - filtered), 3),
+    }
+
+    if per_filter:
+        result['filters'] = []
+        previous = decode
+        for i, step in enumerate(steps):
+            elapsed = filtered if i == len(steps) - 1 else _timed_pass(
+                input_path, sample_seconds, steps[:i + 1], decode_args=decode_args
+            )
+            result['filters'].append({'filter': step, 'seconds': round(max(0.0, elapsed - previous), 3)})
+            previous = elapsed
+
+    logger.info(f"Profiled {decade}: {result['decode']}s decode, {result['filter']}s filter, {result['encode']}s encode")
+    return result
@@ -0,0 +1,99 @@
+# result_cache.py - Content-addressed cache of finished outputs
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from janitor import sharded_path
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Size-bounded LRU cache of processed videos on disk
+
+    Entries are named after their key (sharded by its first characters), and
+    a file's mtime is bumped on every hit so the oldest mtime is always the
+    least recently used entry.
+    """
+
+    def __init__(self, folder, max_bytes, extension='.mp4'):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def make_key(input_hash, decade, custom_options, encoder_settings, filter_string=''):
+        """Key identifying one (input, decade, options, encoder) combination"""
+        payload = json.dumps({
+            'input': input_hash,
+            'decade': decade,
+            'options': custom_options or {},
+            'encoder': encoder_settings,
+            'filters': filter_string,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return sharded_path(self.folder, key + self.extension)
+
+    def get(self, key):
+        """Path of the cached output for key, or None on a miss"""
+        path = self.path_for(key)
+        with self._lock:
+            if not os.path.exists(path):
+                return None
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        logger.info(f"Result cache hit {key[:12]}")
+        return path
+
+    def put(self, key, output_path):
+        """Move a finished output into the cache and return its new path"""
+        path = self.path_for(key)
+        with self._lock:
+            os.replace(output_path, path)
+            self._evict(keep=path)
+        return path
+
+    def _evict(self, keep=None):
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                logger.info(f"Evicted {os.path.basename(path)} from result cache")
+            except OSError as e:
+                # Usually a file that is still being downloaded on Windows
+                logger.warning(f"Could not evict {path}: {e}")
@@ -0,0 +1,86 @@
+# server.py - Headless production server with health checks and graceful drain
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+
+try:
+    from cheroot import wsgi
+except ImportError:
+    wsgi = None
+
+logger = logging.getLogger(__name__)
+
+SERVER_AVAILABLE = wsgi is not None
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 5000
+# Streamed uploads hold a thread for as long as they upload, so keep
+# plenty more threads than encode slots
+DEFAULT_THREADS = int(os.environ.get('OLDFILMS_SERVER_THREADS', '16'))
+# How long shutdown waits for queued and running encodes to finish
+DRAIN_TIMEOUT = float(os.environ.get('OLDFILMS_DRAIN_SECONDS', '600'))
+
+
+def make_server(app, host=DEFAULT_HOST, port=DEFAULT_PORT, threads=DEFAULT_THREADS, max_body_bytes=None):
+    """Threaded cheroot WSGI server for app
+
+    Unlike servers that buffer whole requests first, cheroot hands the body
+    to the app while it arrives, which /api/process-stream relies on.
+    """
+    if wsgi is None:
+        raise RuntimeError("The production server needs cheroot (pip install cheroot)")
+    server = wsgi.Server((host, port), app, numthreads=threads, server_name='oldfilms')
+    if max_body_bytes:
+        server.max_request_body_size = max_body_bytes
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve Old Films Filters without the desktop launcher')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='request handling threads')
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT,
+                        help='seconds to wait for running encodes on shutdown')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if not SERVER_AVAILABLE:
+        parser.error("cheroot is not installed (pip install cheroot)")
+
+    # Imported only here so app.py can use make_server without loading itself twice
+    import app as oldfilms
+
+    server = make_server(oldfilms.app, args.host, args.port, args.threads, oldfilms.MAX_UPLOAD_BYTES)
+    stopping = threading.Event()
+
+    def drain_and_stop():
+        oldfilms.begin_drain()
+        if not oldfilms.job_manager.wait_idle(args.drain_timeout):
+            logger.warning("Drain timed out, stopping the jobs still running")
+            oldfilms.terminate_encodes()
+        oldfilms.disk_janitor.stop()
+        oldfilms.preset_registry.stop()
+        server.stop()
+
+    def handle_signal(signum, frame):
+        if stopping.is_set():
+            # A second signal skips the drain
+            raise KeyboardInterrupt
+        stopping.set()
+        logger.info("Shutting down once running jobs finish (signal again to stop now)")
+        threading.Thread(target=drain_and_stop, name='oldfilms-drain', daemon=True).start()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    logger.info(f"Serving on http://{args.host}:{args.port} with {args.threads} threads")
+    server.safe_start()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
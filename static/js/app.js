@@ -5,6 +5,8 @@
 // 应用状态
 let selectedFile = null;
 let selectedDecade = '1980s';
+// 服务器端预览源的 ID，同一文件的后续预览无需重新上传
+let previewUploadId = null;
 
 // 创建动态星空背景
 function createStarfield() {
@@ -45,13 +47,13 @@ const decadeConfigs = {
         'sepia_intensity': {'min': 0.5, 'max': 1.5, 'default': 1.0, 'label': '棕褐色强度'},
         'scratches_level': {'min': 30, 'max': 70, 'default': 50, 'label': '胶片划痕'},
         'vignette_strength': {'min': 0.3, 'max': 1.0, 'default': 0.7, 'label': '暗角效果'},
-        'flicker_enabled': {'enabled': true, 'label': '胶片闪烁效果'},
+        'flicker_enabled': {'enabled': false, 'label': '胶片闪烁效果'},
         'frame_rate': {'min': 8, 'max': 18, 'default': 12, 'label': '播放速度 (帧/秒)'}
     },
     '1910s': {
         'contrast_level': {'min': 1.0, 'max': 2.0, 'default': 1.35, 'label': '胶片对比度'},
         'grain_intensity': {'min': 20, 'max': 60, 'default': 40, 'label': '胶片颗粒'},
-        'flicker_enabled': {'enabled': true, 'label': '默片闪烁效果'},
+        'flicker_enabled': {'enabled': false, 'label': '默片闪烁效果'},
         'title_card_enabled': {'enabled': false, 'label': '添加标题卡片'},
         'title_card_text': {'default': '默片时代', 'label': '标题卡片文字'}
     },
@@ -97,17 +99,17 @@ const decadeConfigs = {
     '1980s': {
         'static_level': {'min': 5, 'max': 25, 'default': 12, 'label': 'VHS静电干扰'},
         'color_bleeding': {'min': 1.0, 'max': 1.8, 'default': 1.25, 'label': '色彩溢出'},
-        'timestamp_enabled': {'enabled': true, 'label': 'VHS时间戳'},
+        'timestamp_enabled': {'enabled': false, 'label': 'VHS时间戳'},
         'timestamp_text': {'default': '1985/12/25 14:30', 'label': '自定义时间戳'},
-        'scanlines_enabled': {'enabled': true, 'label': 'VHS扫描线'},
+        'scanlines_enabled': {'enabled': false, 'label': 'VHS扫描线'},
         'tracking_issues': {'enabled': false, 'label': '磁迹跟踪问题'}
     },
     '1990s': {
         'digital_noise': {'min': 3, 'max': 15, 'default': 8, 'label': '数字伪影'},
         'camcorder_saturation': {'min': 0.9, 'max': 1.4, 'default': 1.1, 'label': '摄像机色彩'},
-        'timestamp_enabled': {'enabled': true, 'label': '数字日期戳'},
+        'timestamp_enabled': {'enabled': false, 'label': '数字日期戳'},
         'timestamp_text': {'default': '1995/12/25 14:30:45', 'label': '自定义日期/时间'},
-        'auto_focus_enabled': {'enabled': true, 'label': '自动对焦搜索'},
+        'auto_focus_enabled': {'enabled': false, 'label': '自动对焦搜索'},
         'zoom_artifacts': {'enabled': false, 'label': '数字缩放伪影'}
     }
 };
@@ -127,6 +129,8 @@ const selectedDecadeBadge = document.getElementById('selectedDecadeBadge');
 const resultSection = document.getElementById('resultSection');
 const processedVideo = document.getElementById('processedVideo');
 const downloadBtn = document.getElementById('downloadBtn');
+const previewBtn = document.getElementById('previewBtn');
+const previewImage = document.getElementById('previewImage');
 
 // 初始化年代选项
 function initializeDecades() {
@@ -148,6 +152,7 @@ function initializeDecades() {
             option.classList.add('selected');
             selectedDecade = decade;
             updateCustomizationPanel();
+            refreshPreview();
 
             // 添加点击动画
             option.style.animation = 'decadeCardAppear 0.6s ease-out';
@@ -191,6 +196,9 @@ function handleFileSelection(file) {
     fileName.textContent = file.name;
     fileInfo.classList.remove('hidden');
     processBtn.disabled = false;
+    previewBtn.disabled = false;
+    previewUploadId = null;
+    previewImage.classList.add('hidden');
 
     // 添加文件选择动画
     fileInfo.style.animation = 'fileInfoSlide 0.6s cubic-bezier(0.25, 0.46, 0.45, 0.94)';
@@ -319,6 +327,239 @@ function getCustomOptions() {
     return customOptions;
 }
 
+// 源视频信息（分辨率、帧率、时长），来自服务器的探测结果
+function describeMedia(media) {
+    if (!media) return '';
+    const parts = [];
+    if (media.width && media.height) parts.push(`${media.width}×${media.height}`);
+    if (media.frame_rate) parts.push(`${Math.round(media.frame_rate)} 帧/秒`);
+    if (media.duration) parts.push(`${media.duration.toFixed(1)} 秒`);
+    return parts.length ? `（源视频 ${parts.join(' · ')}）` : '';
+}
+
+// 显示服务器上报的真实编码进度
+function showJobProgress(progress, media) {
+    if (!progress) {
+        statusText.textContent = `正在处理视频并添加复古效果...${describeMedia(media)}`;
+        return;
+    }
+
+    if (progress.percent !== null) {
+        progressFill.style.width = `${progress.percent}%`;
+    }
+
+    const parts = [];
+    if (progress.percent !== null) parts.push(`${progress.percent.toFixed(1)}%`);
+    if (progress.fps) parts.push(`${progress.fps.toFixed(1)} 帧/秒`);
+    if (progress.speed) parts.push(`${progress.speed.toFixed(2)}x 实时`);
+    if (progress.eta !== null) parts.push(`剩余约 ${Math.ceil(progress.eta)} 秒`);
+    statusText.textContent = `正在处理视频... ${parts.join(' · ')}${describeMedia(media)}`;
+}
+
+// 请求当前年代与参数的快速预览帧
+async function requestPreview() {
+    if (!selectedFile) return;
+
+    const formData = new FormData();
+    if (previewUploadId) {
+        formData.append('upload_id', previewUploadId);
+    } else {
+        formData.append('video', selectedFile);
+    }
+    formData.append('decade', selectedDecade);
+    const customOptions = getCustomOptions();
+    if (customOptions) {
+        formData.append('custom_options', JSON.stringify(customOptions));
+    }
+
+    previewBtn.disabled = true;
+    try {
+        const response = await fetch('/api/preview', { method: 'POST', body: formData });
+        if (response.status === 404 && previewUploadId) {
+            // 服务器已清理预览源，重新上传
+            previewUploadId = null;
+            await requestPreview();
+            return;
+        }
+        if (!response.ok) {
+            throw new Error(await response.text());
+        }
+
+        previewUploadId = response.headers.get('X-Upload-Id');
+        const blob = await response.blob();
+        if (previewImage.src) {
+            URL.revokeObjectURL(previewImage.src);
+        }
+        previewImage.src = URL.createObjectURL(blob);
+        previewImage.classList.remove('hidden');
+    } catch (error) {
+        console.error('Preview error:', error);
+    } finally {
+        previewBtn.disabled = false;
+    }
+}
+
+// 预览已显示时，参数变化后自动刷新
+function refreshPreview() {
+    if (!previewImage.classList.contains('hidden')) {
+        requestPreview();
+    }
+}
+
+previewBtn.addEventListener('click', requestPreview);
+document.getElementById('customizationOptions').addEventListener('change', refreshPreview);
+
+// 大文件分块上传：断线后只补传缺失的分块，已上传过的相同文件直接跳过
+const CHUNKED_UPLOAD_MIN_BYTES = 32 * 1024 * 1024;
+// 整个文件的 SHA-256 需要一次读入内存，只对不太大的文件计算
+const HASH_MAX_BYTES = 256 * 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
+const CRC32_TABLE = (() => {
+    const table = new Uint32Array(256);
+    for (let n = 0; n < 256; n++) {
+        let c = n;
+        for (let k = 0; k < 8; k++) {
+            c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+        }
+        table[n] = c >>> 0;
+    }
+    return table;
+})();
+
+// 分块校验和，服务器写入前核对
+function crc32(bytes) {
+    let crc = 0xFFFFFFFF;
+    for (let i = 0; i < bytes.length; i++) {
+        crc = CRC32_TABLE[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+    }
+    return ((crc ^ 0xFFFFFFFF) >>> 0).toString(16);
+}
+
+// 整个文件的 SHA-256；非 HTTPS 页面（如局域网 IP 访问）没有 crypto.subtle，返回 null
+async function sha256Hex(file) {
+    if (!window.crypto || !crypto.subtle || file.size > HASH_MAX_BYTES) {
+        return null;
+    }
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// 服务器繁忙时返回 429，Retry-After 给出建议等待的秒数
+function checkBusy(response) {
+    if (response.status === 429) {
+        const retryAfter = response.headers.get('Retry-After');
+        throw new Error(`服务器繁忙，请 ${retryAfter || 60} 秒后重试`);
+    }
+}
+
+async function putChunk(uploadId, index, bytes) {
+    const checksum = crc32(bytes);
+    for (let attempt = 1; attempt <= CHUNK_RETRIES; attempt++) {
+        let response = null;
+        try {
+            response = await fetch(`/api/uploads/${uploadId}/chunks/${index}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream', 'X-Chunk-CRC32': checksum },
+                body: bytes
+            });
+        } catch (error) {
+            console.warn(`Chunk ${index} failed:`, error);
+        }
+        if (response && response.ok) {
+            return;
+        }
+        if (response && response.status === 404) {
+            throw new Error('上传会话已过期，请重新上传');
+        }
+        // 网络抖动或校验失败时逐渐延长等待再重试
+        if (attempt < CHUNK_RETRIES) {
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+        }
+    }
+    throw new Error('分块上传失败，请检查网络后重试');
+}
+
+// 分块上传文件，返回服务器端的上传 ID（文件内容的 SHA-256）
+async function uploadInChunks(file, onProgress) {
+    // 同一文件再次上传时，从本地记录的会话继续
+    const resumeKey = `oldfilms-upload:${file.name}:${file.size}:${file.lastModified}`;
+    let session = null;
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+        const response = await fetch(`/api/uploads/${savedId}`);
+        if (response.ok) {
+            session = await response.json();
+        }
+    }
+
+    if (!session) {
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, sha256: await sha256Hex(file) })
+        });
+        checkBusy(response);
+        if (!response.ok) {
+            throw new Error('无法开始上传，请稍后重试');
+        }
+        session = await response.json();
+        if (!session.complete) {
+            localStorage.setItem(resumeKey, session.upload_id);
+        }
+    }
+
+    if (!session.complete) {
+        const received = new Set(session.received);
+        for (let index = 0; index < session.chunks; index++) {
+            if (received.has(index)) {
+                continue;
+            }
+            const start = index * session.chunk_size;
+            const blob = file.slice(start, Math.min(start + session.chunk_size, file.size));
+            await putChunk(session.upload_id, index, new Uint8Array(await blob.arrayBuffer()));
+            received.add(index);
+            onProgress(received.size / session.chunks);
+        }
+
+        const response = await fetch(`/api/uploads/${session.upload_id}/finalize`, { method: 'POST' });
+        if (!response.ok) {
+            localStorage.removeItem(resumeKey);
+            throw new Error('上传校验失败，请重新上传');
+        }
+        session = await response.json();
+    }
+
+    localStorage.removeItem(resumeKey);
+    onProgress(1);
+    return session.upload_id;
+}
+
+// 轮询任务状态，直到处理完成或失败
+async function waitForJob(statusUrl) {
+    while (true) {
+        const response = await fetch(statusUrl);
+        if (!response.ok) {
+            throw new Error('无法获取任务状态');
+        }
+
+        const job = await response.json();
+        if (job.status === 'done' || job.status === 'failed') {
+            return job;
+        }
+
+        if (job.status === 'queued') {
+            statusText.textContent = job.estimated_seconds
+                ? `排队等待处理中（预计处理约 ${Math.ceil(job.estimated_seconds)} 秒）...`
+                : '排队等待处理中...';
+        } else {
+            showJobProgress(job.progress, job.media);
+        }
+
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 // 处理视频
 processBtn.addEventListener('click', async () => {
     if (!selectedFile) return;
@@ -345,53 +586,81 @@ processBtn.addEventListener('click', async () => {
         '1990s': '1990年代'
     };
 
-    statusText.textContent = `正在应用${decadeTextMap[selectedDecade]}滤镜与自定义设置...`;
-    progressFill.style.width = '30%';
+    statusText.textContent = `正在上传视频，准备应用${decadeTextMap[selectedDecade]}滤镜...`;
+    progressFill.style.width = '0%';
 
     try {
-        const formData = new FormData();
-        formData.append('video', selectedFile);
-        formData.append('decade', selectedDecade);
+        const params = new URLSearchParams({
+            filename: selectedFile.name,
+            decade: selectedDecade
+        });
 
         // 添加自定义选项
         const customOptions = getCustomOptions();
         if (customOptions) {
-            formData.append('custom_options', JSON.stringify(customOptions));
+            params.append('custom_options', JSON.stringify(customOptions));
         }
 
-        progressFill.style.width = '60%';
-        statusText.textContent = '正在处理视频并添加复古效果...';
-
-        const response = await fetch('/api/process-video', {
-            method: 'POST',
-            body: formData
-        });
-
-        if (response.ok) {
-            progressFill.style.width = '100%';
-            statusText.textContent = '完成！ ✨ 您的复古影像杰作已准备就绪！';
-
-            const blob = await response.blob();
-            const videoUrl = URL.createObjectURL(blob);
+        // 编码档位，留空时由服务器按年代选择
+        const encodeProfile = document.getElementById('encodeProfile').value;
+        if (encodeProfile) {
+            params.append('encode_profile', encodeProfile);
+        }
 
-            document.getElementById('processedVideo').src = videoUrl;
-            document.getElementById('downloadBtn').href = videoUrl;
-            document.getElementById('downloadBtn').download = `${selectedDecade}-复古-${Date.now()}.mp4`;
+        let response;
+        if (selectedFile.size >= CHUNKED_UPLOAD_MIN_BYTES) {
+            // 大文件先分块上传，完成后按上传 ID 提交处理
+            const uploadId = await uploadInChunks(selectedFile, fraction => {
+                progressFill.style.width = `${Math.round(fraction * 100)}%`;
+                statusText.textContent = `正在上传视频... ${Math.round(fraction * 100)}%`;
+            });
+            params.delete('filename');
+            params.append('upload_id', uploadId);
+            response = await fetch('/api/process-video', { method: 'POST', body: params });
+        } else {
+            // 小文件直接作为请求体上传，服务器可在上传过程中同步开始处理
+            response = await fetch(`/api/process-stream?${params}`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: selectedFile
+            });
+        }
 
-            resultSection.classList.remove('hidden');
+        checkBusy(response);
 
-            // 滚动到结果区域
-            setTimeout(() => {
-                resultSection.scrollIntoView({
-                    behavior: 'smooth',
-                    block: 'start'
-                });
-            }, 500);
-        } else {
+        if (!response.ok) {
             const errorText = await response.text();
             console.error('Server error:', errorText);
+            throw new Error('视频上传失败，请稍后重试');
+        }
+
+        const job = await response.json();
+        progressFill.style.width = '0%';
+        statusText.textContent = '正在处理视频并添加复古效果...';
+
+        const finishedJob = await waitForJob(job.status_url);
+        if (finishedJob.status !== 'done') {
+            console.error('Job failed:', finishedJob.error);
             throw new Error('视频处理失败，请稍后重试');
         }
+
+        progressFill.style.width = '100%';
+        statusText.textContent = '完成！ ✨ 您的复古影像杰作已准备就绪！';
+
+        // 直接使用服务器地址播放：浏览器按需发送 Range 请求，可边下边播、随意拖动
+        document.getElementById('processedVideo').src = job.stream_url;
+        document.getElementById('downloadBtn').href = job.download_url;
+        document.getElementById('downloadBtn').download = `${selectedDecade}-复古-${Date.now()}.mp4`;
+
+        resultSection.classList.remove('hidden');
+
+        // 滚动到结果区域
+        setTimeout(() => {
+            resultSection.scrollIntoView({
+                behavior: 'smooth',
+                block: 'start'
+            });
+        }, 500);
     } catch (error) {
         console.error('Processing error:', error);
         statusText.textContent = '错误: ' + error.message;
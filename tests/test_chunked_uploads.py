@@ -0,0 +1,23 @@
+import hashlib
+
+import pytest
+
+from chunked_uploads import ChunkedUploadStore, UploadError
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkedUploadStore(str(tmp_path / 'partial'), str(tmp_path / 'store'))
+
+
+@pytest.mark.parametrize('content_hash', [123, ['a' * 64], 'xyz', 'g' * 64, 'a' * 63, 'a' * 64 + '\n'])
+def test_start_rejects_malformed_sha256(store, content_hash):
+    with pytest.raises(UploadError):
+        store.start('clip.mp4', 100, content_hash)
+
+
+def test_start_accepts_sha256_in_either_case(store):
+    digest = hashlib.sha256(b'clip').hexdigest()
+    for content_hash in (None, digest, digest.upper()):
+        session = store.start('clip.mp4', 100, content_hash)
+        assert not session['complete']
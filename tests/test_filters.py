@@ -0,0 +1,47 @@
+import pytest
+
+import oldfilms_filters
+from oldfilms_filters import build_filter_command, chain_frame_rate, get_decade_filter_config
+from presets import PresetError, PresetSnapshot
+
+
+def _vignette(options):
+    return [step for step in build_filter_command('1900s', options).split(',') if step.startswith('vignette=')]
+
+
+def test_vignette_strength_varies_above_the_default():
+    assert _vignette({'vignette_strength': 0.8}) != _vignette({'vignette_strength': 1.0})
+
+
+def test_vignette_strength_default_keeps_the_preset_angle():
+    preset = get_decade_filter_config()['1900s']
+    assert _vignette({}) == [step for step in preset['filters'] if step.startswith('vignette=')]
+
+
+@pytest.mark.parametrize('steps, rate', [
+    (['fps=12'], 12.0),
+    (['fps=24000/1001'], 24000 / 1001),
+    (['fps=fps=25:round=near'], 25.0),
+    (['eq=contrast=1.2'], None),
+])
+def test_chain_frame_rate_reads_ffmpeg_rates(steps, rate):
+    assert chain_frame_rate(steps) == pytest.approx(rate)
+
+
+def _snapshot(filters, options=None):
+    config = {'name': 'Test', 'description': '', 'max_height': 480, 'filters': filters, 'options': options or {}}
+    return PresetSnapshot({'1900s': config}, 'test')
+
+
+def test_check_presets_accepts_ffmpeg_expressions():
+    oldfilms_filters._check_presets(_snapshot(
+        ['fps=24000/1001', 'noise=alls=20:allf=t', 'vignette=angle=PI*0.3'],
+        {'vignette_strength': {'min': 0.3, 'max': 1.0, 'default': 0.7, 'label': 'Vignette'}}
+    ))
+
+
+@pytest.mark.parametrize('filters', [['fps=ntsc'], ['vignette=angle=PI-0.5'], ['noise=alls=lots']])
+def test_check_presets_rejects_values_the_compiler_cannot_read(filters):
+    options = {'vignette_strength': {'min': 0.3, 'max': 1.0, 'default': 0.7, 'label': 'Vignette'}}
+    with pytest.raises(PresetError):
+        oldfilms_filters._check_presets(_snapshot(filters, options))
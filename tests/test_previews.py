@@ -0,0 +1,39 @@
+import pytest
+
+from oldfilms_filters import build_filter_steps, get_decade_filter_config
+from previews import PREVIEW_HEIGHT, preview_filter_command
+
+SOURCE_HEIGHT = 1080
+
+
+def _pixel_params(steps, name, key):
+    """Values of one parameter (e.g. noise alls=) across a chain, in order"""
+    values = []
+    for step in steps:
+        step_name, _, params = step.partition('=')
+        for param in params.split(':'):
+            param_key, _, value = param.partition('=')
+            if (step_name, param_key) == (name, key):
+                values.append(float(value))
+    return values
+
+
+@pytest.mark.parametrize('decade', list(get_decade_filter_config()))
+def test_preview_grain_matches_the_real_job_scaled_to_preview(decade):
+    output_height = get_decade_filter_config()[decade]['max_height']
+    preview_height = min(output_height, PREVIEW_HEIGHT)
+    real = build_filter_steps(decade, source_height=SOURCE_HEIGHT)
+    preview = preview_filter_command(decade, None, SOURCE_HEIGHT).split(',')
+
+    # The real output shrunk from its own height to the preview's; noise
+    # strengths are whole numbers, so they may round one step apart
+    ratio = preview_height / output_height
+    for name, key, tolerance in (('noise', 'alls', 1), ('gblur', 'sigma', 0.01)):
+        expected = [value * ratio for value in _pixel_params(real, name, key)]
+        assert _pixel_params(preview, name, key) == pytest.approx(expected, abs=tolerance)
+
+
+def test_preview_of_a_small_source_keeps_the_preset_grain():
+    steps = preview_filter_command('1960s', None, 240).split(',')
+    preset = get_decade_filter_config()['1960s']['filters']
+    assert _pixel_params(steps, 'noise', 'alls') == _pixel_params(preset, 'noise', 'alls')
@@ -0,0 +1,141 @@
+# textures.py - Pre-rendered texture atlases for the frame engine, cached on disk
+
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+TEXTURE_DIR = os.environ.get('OLDFILMS_TEXTURE_DIR') or os.path.join(tempfile.gettempdir(), 'oldfilms_textures')
+# Bump when a renderer changes so stale atlases on disk are not reused
+TEXTURE_VERSION = 1
+# Atlases kept in memory across jobs, by total bytes
+MEMORY_BYTES = 64 * 1024 * 1024
+
+# Light leaks are soft gradients, so masks at a quarter of the frame size
+# upscale without visible steps; the leak drifts once round the loop
+LEAK_SCALE = 4
+LEAK_LOOP_FRAMES = 256
+LEAK_LOOP_SECONDS = 24
+# Dust plates are shown in random order, so a short loop does not repeat visibly
+DUST_LOOP_FRAMES = 64
+
+
+def dust_specks(height, level):
+    """Number of dust specks per frame for a scratches level"""
+    return int(level * 3 * max(1, height // 240))
+
+
+def render_leak_atlas(width, height, intensity=0):
+    """Light leak masks (0-255) along one loop of the leak's path, at 1/LEAK_SCALE size"""
+    small_width = -(-width // LEAK_SCALE)
+    small_height = -(-height // LEAK_SCALE)
+    x = np.arange(small_width, dtype=np.float32)
+    y = np.arange(small_height, dtype=np.float32)
+    masks = np.empty((LEAK_LOOP_FRAMES, small_height, small_width), np.uint8)
+    for i in range(LEAK_LOOP_FRAMES):
+        phase = 2 * np.pi * i / LEAK_LOOP_FRAMES
+        cx = small_width * (0.5 + 0.45 * np.sin(phase))
+        cy = small_height * (0.3 + 0.2 * np.cos(2 * phase))
+        gx = np.exp(-((x - cx) / (small_width * 0.3)) ** 2)
+        gy = np.exp(-((y - cy) / (small_height * 0.45)) ** 2)
+        masks[i] = np.outer(gy, gx) * 255
+    return {'masks': masks}
+
+
+def render_dust_atlas(width, height, intensity):
+    """DUST_LOOP_FRAMES plates of dust specks as flat pixel indices and shades"""
+    rng = np.random.default_rng(intensity)
+    shape = (DUST_LOOP_FRAMES, dust_specks(height, intensity))
+    return {
+        'indices': rng.integers(0, width * height, shape, dtype=np.int32),
+        'shades': rng.choice(np.array([15, 235], np.uint8), shape),
+    }
+
+
+RENDERERS = {
+    'leak': render_leak_atlas,
+    'dust': render_dust_atlas,
+}
+
+
+class TextureCache:
+    """Atlases per (kind, resolution, intensity), rendered once and reused
+
+    Rendered atlases are written to folder as compressed .npz files, so later
+    jobs and restarts load them instead of rendering again, and the most
+    recently used ones are kept in memory up to max_bytes.
+    """
+
+    def __init__(self, folder=TEXTURE_DIR, max_bytes=MEMORY_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._bytes = 0
+
+    def path_for(self, kind, width, height, intensity):
+        return os.path.join(self.folder, f'{kind}_{width}x{height}_{intensity}_v{TEXTURE_VERSION}.npz')
+
+    def get(self, kind, width, height, intensity=0):
+        """The atlas as a dict of arrays, from memory, disk or freshly rendered"""
+        key = (kind, width, height, intensity)
+        with self._lock:
+            atlas = self._memory.get(key)
+            if atlas is not None:
+                self._memory.move_to_end(key)
+                return atlas
+
+        path = self.path_for(kind, width, height, intensity)
+        atlas = self._load(path)
+        if atlas is None:
+            atlas = RENDERERS[kind](width, height, intensity)
+            self._save(path, atlas)
+
+        with self._lock:
+            if key not in self._memory:
+                self._memory[key] = atlas
+                self._bytes += sum(array.nbytes for array in atlas.values())
+                while self._bytes > self.max_bytes and len(self._memory) > 1:
+                    _, evicted = self._memory.popitem(last=False)
+                    self._bytes -= sum(array.nbytes for array in evicted.values())
+            return self._memory[key]
+
+    def _load(self, path):
+        try:
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable texture {path}: {e}")
+            return None
+
+    def _save(self, path, atlas):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # Written under a temporary name so readers never see half a file
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **atlas)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not store texture {path}: {e}")
+
+
+_shared_cache = None
+
+
+def get_texture_cache():
+    """The process-wide texture cache"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = TextureCache()
+    return _shared_cache